@@ -0,0 +1,307 @@
+"""Локальная замена VK API для нагрузочных тестов.
+
+Запуск отдельно: python -m benchmark.fake_vk --port 8080 --latency 0.05
+и VK_API_URL=http://127.0.0.1:8080/method/ в .env бота. Входящие сообщения
+подаются через POST /push {"from_id": 1, "text": "/start"}, счётчики
+вызовов отдаются по GET /stats.
+"""
+import argparse
+import asyncio
+import json
+import random
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+CITIES = [
+    {"id": 1, "title": "Москва", "region": "", "important": 1},
+    {"id": 2, "title": "Санкт-Петербург", "region": "", "important": 1},
+    {"id": 3, "title": "Новосибирск", "region": "", "important": 1},
+    {"id": 4, "title": "Екатеринбург", "region": "", "important": 1},
+    {"id": 5, "title": "Казань", "region": "", "important": 1},
+    {"id": 6, "title": "Нижний Новгород", "region": "", "important": 1},
+    {"id": 7, "title": "Московский", "region": "Московская область", "important": 0},
+]
+
+# Методы настройки Long Poll: в них ошибки не подмешиваются
+SETUP_METHODS = {"groups.getById", "groups.getLongPollServer", "users.get"}
+
+
+class FakeVkError(Exception):
+    """Ошибка, которую фейковый метод возвращает клиенту."""
+
+    def __init__(self, code, message):
+        """Сохраняет код и текст ошибки VK."""
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def parse_execute(code):
+    """Разбирает код VKScript вида return [API.m({...}),...]; в пары (метод, params)."""
+    decoder = json.JSONDecoder()
+    calls = []
+    position = code.find("API.")
+    while position != -1:
+        start = code.index("(", position)
+        params, end = decoder.raw_decode(code, start + 1)
+        calls.append((code[position + 4:start], params))
+        position = code.find("API.", end)
+    return calls
+
+
+class FakeVk:
+    """Фейковый VK API: поиск, фото, города, отправка сообщений и Long Poll.
+
+    latency и jitter задают задержку каждого HTTP-запроса (сек), error_rate —
+    долю запросов, на которые возвращается ошибка error_code (по умолчанию 6,
+    «слишком много запросов»). Результаты поиска детерминированы: total
+    пользователей на каждый набор критериев, каждый десятый — закрытый.
+    """
+
+    def __init__(
+        self, latency=0.0, jitter=0.0, error_rate=0.0, error_code=6, total=1000
+    ):
+        """Задаёт задержку, долю ошибок и число результатов поиска."""
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.total = total
+        self.requests = Counter()  # HTTP-запросы по методам (execute — один)
+        self.calls = Counter()  # вызовы методов, включая вложенные в execute
+        self.errors = Counter()  # подмешанные ошибки по методам
+        self.sent = defaultdict(list)  # user_id -> тексты отправленных сообщений
+        self.url = None
+        self._events = []
+        self._changed = None
+        self._message_id = 0
+        self._runner = None
+        self._loop = None
+
+    def reset_stats(self):
+        """Обнуляет счётчики вызовов и отправленные сообщения."""
+        self.requests.clear()
+        self.calls.clear()
+        self.errors.clear()
+        self.sent.clear()
+
+    def push_message(self, from_id, text):
+        """Кладёт входящее сообщение в Long Poll (можно вызывать из любого потока)."""
+        message = {"from_id": from_id, "peer_id": from_id, "text": text}
+        event = {"type": "message_new", "object": {"message": message}}
+        self._loop.call_soon_threadsafe(self._add_event, event)
+
+    def _add_event(self, event):
+        """Добавляет событие и будит ожидающие запросы Long Poll."""
+        self._events.append(event)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    # Методы API
+
+    def users_search(self, params):
+        """users.search: страница детерминированных результатов."""
+        base = (int(params["city_id"]) * 100 + int(params["age_from"])) * 10
+        base = (base + int(params.get("sex", 0))) * 100000
+        offset = int(params.get("offset", 0))
+        count = max(0, min(int(params.get("count", 20)), self.total - offset))
+        items = []
+        for i in range(offset, offset + count):
+            items.append(
+                {
+                    "id": base + i + 1,
+                    "first_name": f"Имя{i}",
+                    "last_name": f"Фамилия{i}",
+                    "is_closed": i % 10 == 9,
+                    "can_access_closed": False,
+                }
+            )
+        return {"count": self.total, "items": items}
+
+    def photos_get(self, params):
+        """photos.get: пять фото профиля с разным числом лайков."""
+        owner_id = int(params["owner_id"])
+        return {
+            "count": 5,
+            "items": [
+                {
+                    "id": i + 1,
+                    "owner_id": owner_id,
+                    "likes": {"count": (owner_id * (i + 3)) % 97},
+                    "comments": {"count": i},
+                }
+                for i in range(5)
+            ],
+        }
+
+    def database_get_cities(self, params):
+        """database.getCities: города, название которых начинается с q."""
+        query = str(params.get("q", "")).lower()
+        items = [c for c in CITIES if c["title"].lower().startswith(query)]
+        return {"count": len(items), "items": items}
+
+    def messages_send(self, params):
+        """messages.send: запоминает текст сообщения."""
+        self.sent[int(params["user_id"])].append(params.get("message", ""))
+        self._message_id += 1
+        return self._message_id
+
+    def groups_get_by_id(self, params):
+        """groups.getById: одно сообщество."""
+        return {"groups": [{"id": 1, "name": "Fake"}]}
+
+    def groups_get_long_poll_server(self, params):
+        """groups.getLongPollServer: адрес локального Long Poll."""
+        return {
+            "server": self.url + "longpoll",
+            "key": "fake",
+            "ts": str(len(self._events)),
+        }
+
+    def users_get(self, params):
+        """users.get: пользователь для проверки токена."""
+        return [{"id": 1, "first_name": "Павел", "last_name": "Дуров"}]
+
+    def call(self, method, params):
+        """Выполняет один метод API."""
+        self.calls[method] += 1
+        handler = {
+            "users.search": self.users_search,
+            "photos.get": self.photos_get,
+            "database.getCities": self.database_get_cities,
+            "messages.send": self.messages_send,
+            "groups.getById": self.groups_get_by_id,
+            "groups.getLongPollServer": self.groups_get_long_poll_server,
+            "users.get": self.users_get,
+        }.get(method)
+        if handler is None:
+            raise FakeVkError(3, "Unknown method passed")
+        return handler(params)
+
+    # HTTP
+
+    async def _delay(self):
+        """Имитирует сетевую задержку."""
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def handle_method(self, request):
+        """POST /method/{name}."""
+        method = request.match_info["name"]
+        params = dict(await request.post())
+        self.requests[method] += 1
+        await self._delay()
+        if method not in SETUP_METHODS and random.random() < self.error_rate:
+            self.errors[method] += 1
+            return web.json_response(
+                {"error": {"error_code": self.error_code, "error_msg": "Injected"}}
+            )
+        try:
+            if method == "execute":
+                return web.json_response(self._execute(params["code"]))
+            return web.json_response({"response": self.call(method, params)})
+        except FakeVkError as e:
+            return web.json_response(
+                {"error": {"error_code": e.code, "error_msg": e.message}}
+            )
+
+    def _execute(self, code):
+        """Выполняет вызовы из execute; неудачные возвращают false."""
+        response, errors = [], []
+        for method, params in parse_execute(code):
+            try:
+                response.append(self.call(method, params))
+            except FakeVkError as e:
+                response.append(False)
+                errors.append(
+                    {"method": method, "error_code": e.code, "error_msg": e.message}
+                )
+        data = {"response": response}
+        if errors:
+            data["execute_errors"] = errors
+        return data
+
+    async def handle_longpoll(self, request):
+        """GET /longpoll: события после ts, ожидание до wait секунд."""
+        ts = int(request.query.get("ts", 0))
+        wait = float(request.query.get("wait", 25))
+        if ts >= len(self._events):
+            try:
+                await asyncio.wait_for(self._changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        return web.json_response(
+            {"ts": str(len(self._events)), "updates": self._events[ts:]}
+        )
+
+    async def handle_push(self, request):
+        """POST /push: входящее сообщение для бота."""
+        data = await request.json()
+        self.push_message(int(data["from_id"]), data["text"])
+        return web.json_response({"ok": True})
+
+    async def handle_stats(self, request):
+        """GET /stats: счётчики вызовов."""
+        return web.json_response(
+            {
+                "requests": self.requests,
+                "calls": self.calls,
+                "errors": self.errors,
+                "sent": sum(len(m) for m in self.sent.values()),
+            }
+        )
+
+    def app(self):
+        """Создаёт aiohttp-приложение."""
+        app = web.Application()
+        app.router.add_post("/method/{name}", self.handle_method)
+        app.router.add_get("/longpoll", self.handle_longpoll)
+        app.router.add_post("/push", self.handle_push)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Запускает сервер в текущем цикле событий и возвращает адрес API."""
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}/"
+        return self.url + "method/"
+
+    async def stop(self):
+        """Останавливает сервер."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный фейковый VK API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="разброс, сек")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-code", type=int, default=6)
+    args = parser.parse_args()
+
+    fake = FakeVk(args.latency, args.jitter, args.error_rate, args.error_code)
+
+    async def serve():
+        url = await fake.start(args.host, args.port)
+        print(f"Фейковый VK API: {url}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import bisect
+import json
+import re
+import sys
+import threading
+from collections import Counter, defaultdict
+
+# Распространённые сокращения и разговорные названия городов; названия
+# реальных городов («Ростов» — город в Ярославской области) сюда не входят
+ALIASES = {
+    "спб": "Санкт-Петербург",
+    "питер": "Санкт-Петербург",
+    "петербург": "Санкт-Петербург",
+    "мск": "Москва",
+    "екб": "Екатеринбург",
+    "екат": "Екатеринбург",
+    "нск": "Новосибирск",
+    "новосиб": "Новосибирск",
+    "нн": "Нижний Новгород",
+    "нижний": "Нижний Новгород",
+    "влад": "Владивосток",
+}
+
+
+def normalize(title):
+    """Приводит название к виду для сравнения: нижний регистр, ё→е, без знаков."""
+    title = title.lower().replace("ё", "е")
+    return " ".join(re.sub(r"[\W_]+", " ", title).split())
+
+
+def _distance(a, b, limit):
+    """Расстояние Дамерау-Левенштейна с ранним выходом, если оно больше limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if (
+                prev2 is not None
+                and i > 1
+                and j > 1
+                and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]
+            ):
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def _bigrams(name):
+    """Множество пар соседних букв названия."""
+    return {name[i:i + 2] for i in range(len(name) - 1)}
+
+
+class CityIndex:
+    """Индекс городов в памяти: точное, префиксное и нечёткое совпадение."""
+
+    def __init__(self, cities=()):
+        """Строит индекс по списку городов из БД."""
+        self._by_name = {}  # нормализованное название -> (id, important)
+        self._names = []  # отсортированные названия для поиска по префиксу
+        self._by_length = defaultdict(list)  # длина -> названия (для опечаток)
+        self._by_bigram = defaultdict(set)  # пара букв -> названия с ней
+        # add_cities идёт в цикле событий, а find_similar — в отдельном потоке
+        self._lock = threading.Lock()
+        self.add_cities(cities)
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def add_cities(self, cities):
+        """Добавляет города (словари с id, title, important) в индекс."""
+        with self._lock:
+            for city in cities:
+                key = normalize(city["title"])
+                if not key:
+                    continue
+                important = bool(city.get("important"))
+                current = self._by_name.get(key)
+                if current is None:
+                    bisect.insort(self._names, key)
+                    self._by_length[len(key)].append(key)
+                    for gram in _bigrams(key):
+                        self._by_bigram[gram].add(key)
+                elif current[1] or not important:
+                    continue  # Одноимённые города: оставляем крупный
+                self._by_name[key] = (city["id"], important)
+
+    def resolve_alias(self, title):
+        """Возвращает полное название города для сокращения или исходный текст."""
+        return ALIASES.get(normalize(title), title)
+
+    def find(self, title):
+        """Возвращает ID города по точному или префиксному совпадению или None.
+
+        Сокращение раскрывается, только если города с таким названием нет.
+        """
+        key = normalize(title)
+        if key in self._by_name:
+            return self._by_name[key][0]
+        key = normalize(self.resolve_alias(title))
+        if not key:
+            return None
+
+        # Точное совпадение
+        if key in self._by_name:
+            return self._by_name[key][0]
+
+        # Префикс: только среди крупных городов, чтобы «Королёв» не стал «Королёвкой»
+        if len(key) >= 3:
+            pos = bisect.bisect_left(self._names, key)
+            while pos < len(self._names) and self._names[pos].startswith(key):
+                city_id, important = self._by_name[self._names[pos]]
+                if important:
+                    return city_id
+                pos += 1
+        return None
+
+    def find_similar(self, title):
+        """Возвращает ID города, название которого отличается опечаткой, или None.
+
+        Индекс заполняется постепенно, поэтому похожее название может
+        принадлежать другому, реальному городу («Томск» и «Омск»): вызывайте
+        только после того, как VK не нашёл город по названию. Сравнение
+        со всем справочником небыстрое — из цикла событий вызывайте его
+        через asyncio.to_thread.
+        """
+        key = normalize(self.resolve_alias(title))
+        # Одна ошибка в коротких названиях, две — в длинных
+        limit = 1 if len(key) < 8 else 2
+        if len(key) < 4:
+            return None
+        with self._lock:
+            candidates = self._similar_candidates(key, limit)
+        best = None
+        for name in candidates:
+            distance = _distance(key, name, limit)
+            if distance <= limit and (best is None or distance < best[0]):
+                best = (distance, name)
+        return self._by_name[best[1]][0] if best else None
+
+    def _similar_candidates(self, key, limit):
+        """Отбирает названия, которые могут отличаться от key не больше чем на limit.
+
+        Каждая ошибка портит не больше трёх пар соседних букв, поэтому у
+        подходящего названия должны совпадать остальные пары. Для коротких
+        названий такой отбор ничего не даёт — берём все названия близкой длины.
+        """
+        grams = _bigrams(key)
+        need = len(grams) - 3 * limit
+        if need <= 0:
+            return [
+                name
+                for length in range(len(key) - limit, len(key) + limit + 1)
+                for name in self._by_length.get(length, ())
+            ]
+        counts = Counter(
+            name for gram in grams for name in self._by_bigram.get(gram, ())
+        )
+        return [
+            name
+            for name, shared in counts.items()
+            if shared >= need and abs(len(name) - len(key)) <= limit
+        ]
+
+
+def load_dump(path):
+    """Читает JSON-файл со списком городов (id, title, region, important)."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    # Массовая загрузка справочника: python city_index.py cities.json
+    from config import DATABASE_URL
+    from database.manager import DatabaseManager
+
+    db = DatabaseManager(DATABASE_URL)
+    cities = load_dump(sys.argv[1])
+    db.save_cities(cities)
+    db.close()
+    print(f"Загружено городов: {len(cities)}")
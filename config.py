@@ -14,6 +14,76 @@ DB_PASS = os.getenv("DB_PASS")
 
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# Пул соединений с БД (на процесс) и асинхронный драйвер asyncpg:
+# при DB_ASYNC=1 запросы выполняются в отдельном цикле событий, а размер кэша
+# подготовленных выражений задаётся на каждое соединение
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+
+# Параллельная обработка сообщений
+WORKERS_COUNT = int(os.getenv("WORKERS_COUNT", "8"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "100"))
+
+# Число процессов-шардов; больше 1 — сообщения обрабатываются в отдельных
+# процессах, лимиты запросов к VK делятся между ними
+SHARDS = int(os.getenv("SHARDS", "1"))
+SHARD_HEALTH_TIMEOUT = float(os.getenv("SHARD_HEALTH_TIMEOUT", "60"))
+
+# Кэш состояний диалога
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "10000"))
+STATE_CACHE_TTL = float(os.getenv("STATE_CACHE_TTL", "600"))
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "1.0"))
+STATE_WRITE_THROUGH = os.getenv("STATE_WRITE_THROUGH", "0") == "1"
+
+# Кэш и предзагрузка фото кандидатов
+PHOTO_CACHE_SIZE = int(os.getenv("PHOTO_CACHE_SIZE", "10000"))
+PHOTO_CACHE_TTL = float(os.getenv("PHOTO_CACHE_TTL", "3600"))
+PHOTO_PREFETCH = int(os.getenv("PHOTO_PREFETCH", "5"))
+
+# Сколько избранных показывать в одном сообщении (не больше 10)
+FAVORITES_PAGE_SIZE = int(os.getenv("FAVORITES_PAGE_SIZE", "10"))
+
+# Общий кэш страниц поиска
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1000"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "900"))
+
+# Фоновый прогрев кэша поиска для популярных критериев; интервал 0 — выключен
+PREWARM_INTERVAL = float(os.getenv("PREWARM_INTERVAL", "600"))
+PREWARM_TOP = int(os.getenv("PREWARM_TOP", "20"))  # сколько критериев прогревать
+PREWARM_PAGES = int(os.getenv("PREWARM_PAGES", "1"))  # страниц на критерий
+PREWARM_PHOTOS = int(os.getenv("PREWARM_PHOTOS", "10"))  # фото на страницу
+PREWARM_BUDGET = int(os.getenv("PREWARM_BUDGET", "300"))  # вызовов VK за проход
+PREWARM_TTL = float(os.getenv("PREWARM_TTL", "3600"))  # свежесть страниц, сек
+PREWARM_HOURS = os.getenv("PREWARM_HOURS", "")  # например 1-7; пусто — всегда
+
+# Ограничение частоты запросов к VK (в секунду на токен)
+VK_RATE_LIMIT = float(os.getenv("VK_RATE_LIMIT", "3"))
+GROUP_RATE_LIMIT = float(os.getenv("GROUP_RATE_LIMIT", "20"))
+
+# Очередь исходящих сообщений
+OUTBOX_MERGE = os.getenv("OUTBOX_MERGE", "1") == "1"
+OUTBOX_RETRIES = int(os.getenv("OUTBOX_RETRIES", "3"))
+
+# Окно (сек) для объединения запросов к VK в один execute; 0 — без объединения
+VK_BATCH_WINDOW = float(os.getenv("VK_BATCH_WINDOW", "0.01"))
+
+# Адрес VK API; можно направить бота на локальный benchmark.fake_vk
+VK_API_URL = os.getenv("VK_API_URL", "https://api.vk.com/method/")
+
+# Задержка перед переподключением после сбоя: растёт от RESTART_DELAY
+# до RESTART_MAX_DELAY секунд
+RESTART_DELAY = float(os.getenv("RESTART_DELAY", "1"))
+RESTART_MAX_DELAY = float(os.getenv("RESTART_MAX_DELAY", "60"))
+
+# Метрики в формате Prometheus: порт 0 отключает HTTP-эндпоинт
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# Вызовы дольше порога (сек) логируются с аргументами; 0 — не логировать
+SLOW_CALL_THRESHOLD = float(os.getenv("SLOW_CALL_THRESHOLD", "0"))
+
 if not GROUP_TOKEN:
     raise ValueError("Не установлен GROUP_TOKEN в .env")
 if not USER_TOKEN:
@@ -22,4 +92,12 @@ if not all([DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS]):
     raise ValueError(
         "Не установлены все необходимые параметры БД в .env: "
         "DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS"
-    )
\ No newline at end of file
+    )
+
+# Можно указать несколько токенов пользователя через запятую, с весом после
+# двоеточия: USER_TOKEN=токен1,токен2:2 — второй получит вдвое больше запросов
+USER_TOKENS = []
+for item in USER_TOKEN.split(","):
+    token, _, weight = item.strip().partition(":")
+    if token:
+        USER_TOKENS.append((token, int(weight or 1)))
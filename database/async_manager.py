@@ -0,0 +1,148 @@
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database import queries
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_url(db_url):
+    """Подставляет в URL асинхронный драйвер (asyncpg, aiosqlite)."""
+    url = make_url(db_url)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS and url.drivername != ASYNC_DRIVERS[backend]:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    return url
+
+
+def pool_options(url, pool_size, max_overflow, pool_timeout):
+    """Параметры пула соединений (SQLite в памяти работает без пула)."""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+    }
+
+
+class AsyncDatabaseManager:
+    """Асинхронный доступ к БД бота через SQLAlchemy asyncio.
+
+    Для PostgreSQL используется asyncpg: соединения не занимают потоков,
+    а частые запросы (из database.queries) выполняются как подготовленные
+    выражения из кэша размером statement_cache_size на соединение.
+    Методы те же, что у DatabaseManager, но без кэшей состояний.
+    """
+
+    def __init__(
+        self,
+        db_url,
+        pool_size=10,
+        max_overflow=20,
+        pool_timeout=30,
+        statement_cache_size=100,
+    ):
+        """Создаёт движок и пул соединений; схему создаёт migrate()."""
+        url = async_url(db_url)
+        connect_args = {}
+        if url.get_backend_name() == "postgresql":
+            connect_args["prepared_statement_cache_size"] = statement_cache_size
+        self.engine = create_async_engine(
+            url,
+            connect_args=connect_args,
+            **pool_options(url, pool_size, max_overflow, pool_timeout),
+        )
+        self.Session = async_sessionmaker(self.engine)
+
+    async def run(self, func, *args):
+        """Выполняет func(session, *args) из database.queries в новой сессии."""
+        async with self.Session() as session:
+            return await session.run_sync(func, *args)
+
+    async def create_schema(self):
+        """Создаёт недостающие таблицы и индексы."""
+        async with self.engine.begin() as connection:
+            await connection.run_sync(queries.create_schema)
+
+    async def migrate(self):
+        """Создаёт схему и переносит состояния старого формата.
+
+        Возвращает число пользователей, чьи состояния были перенесены.
+        """
+        await self.create_schema()
+        return len(await self.run(queries.migrate_legacy_states))
+
+    async def get_or_create_user(self, vk_id):
+        """Получает или создаёт пользователя по VK ID."""
+        return await self.run(queries.get_or_create_user, vk_id)
+
+    async def load_user_state(self, vk_id):
+        """Читает состояние диалога пользователя."""
+        return await self.run(queries.load_state, vk_id)
+
+    async def save_user_states(self, states):
+        """Записывает пачку состояний {vk_id: state} одним запросом."""
+        await self.run(queries.save_states, states)
+
+    async def get_popular_searches(self, limit=20, shards=1, shard=0):
+        """Возвращает самые частые критерии поиска из сохранённых состояний."""
+        return await self.run(queries.get_popular_searches, limit, shards, shard)
+
+    async def extend_queue(self, user_vk_id, candidates, start):
+        """Дописывает следующую страницу кандидатов в очередь с номера start."""
+        await self.run(queries.fill_queue, user_vk_id, candidates, start)
+
+    async def get_queue_items(self, user_vk_id, start, count):
+        """Возвращает до count кандидатов из очереди, начиная с номера start."""
+        return await self.run(queries.get_queue_items, user_vk_id, start, count)
+
+    async def get_cities(self):
+        """Возвращает все сохранённые города."""
+        return await self.run(queries.get_cities)
+
+    async def save_cities(self, cities):
+        """Сохраняет города из ответа database.getCities, пропуская известные."""
+        if cities:
+            await self.run(queries.save_cities, cities)
+
+    async def get_seen(self, user_vk_id):
+        """Возвращает множество VK ID кандидатов, уже показанных пользователю."""
+        return await self.run(queries.load_seen, user_vk_id)
+
+    async def save_seen(self, seen):
+        """Записывает пачку множеств просмотренных {vk_id: set}."""
+        await self.run(queries.save_seen, seen)
+
+    async def save_candidates(self, candidates):
+        """Сохраняет страницу результатов поиска одним INSERT ... ON CONFLICT."""
+        if candidates:
+            await self.run(queries.save_candidates, candidates)
+
+    async def update_candidate_photos(self, photos):
+        """Записывает фото кандидатов {vk_id: [...]} одним пакетным UPDATE."""
+        if photos:
+            await self.run(queries.update_candidate_photos, photos)
+
+    async def add_to_favorites(
+        self, user_vk_id, candidate_vk_id, first_name, last_name, profile_url, photos
+    ):
+        """Добавляет кандидата в избранное; False — он там уже был."""
+        return await self.run(
+            queries.add_to_favorites,
+            user_vk_id,
+            candidate_vk_id,
+            first_name,
+            last_name,
+            profile_url,
+            photos,
+        )
+
+    async def get_favorites(self, user_vk_id, limit=None, after=None, before=None):
+        """Возвращает избранное пользователя (параметры как у DatabaseManager)."""
+        return await self.run(queries.get_favorites, user_vk_id, limit, after, before)
+
+    async def close(self):
+        """Закрывает пул соединений."""
+        await self.engine.dispose()
@@ -1,107 +1,242 @@
-import json
-
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from database.models import Base, Candidate, Favorite, User
+from database import queries
+from database.async_manager import AsyncDatabaseManager, pool_options
+from database.state_cache import StateCache
+from metrics import DB_ERRORS, DB_SECONDS, timed
 
 
 class DatabaseManager:
     """Менеджер для работы с базой данных бота."""
 
-    def __init__(self, db_url):
-        """Инициализация подключения к БД."""
-        self.engine = create_engine(db_url)
-        self.Session = sessionmaker(bind=self.engine)
-        Base.metadata.create_all(self.engine)
+    def __init__(
+        self,
+        db_url,
+        state_cache_size=10000,
+        state_ttl=600,
+        state_flush_interval=1.0,
+        state_write_through=False,
+        pool_size=10,
+        max_overflow=20,
+        pool_timeout=30,
+        statement_cache_size=100,
+        loop=None,
+    ):
+        """Инициализация подключения к БД.
+
+        pool_size, max_overflow и pool_timeout — настройки пула соединений.
+        Если передан loop (EventLoopThread), запросы выполняет
+        AsyncDatabaseManager с асинхронным драйвером в этом цикле событий,
+        а потоки бота только ждут результата; statement_cache_size — размер
+        кэша подготовленных выражений asyncpg на соединение.
+        Схема не создаётся: для этого есть migrate() (python main.py migrate).
+        """
+        self.loop = loop
+        self.backend = None
+        if loop is None:
+            self.engine = create_engine(
+                db_url, **pool_options(db_url, pool_size, max_overflow, pool_timeout)
+            )
+            self.Session = sessionmaker(bind=self.engine)
+        else:
+            self.backend = AsyncDatabaseManager(
+                db_url, pool_size, max_overflow, pool_timeout, statement_cache_size
+            )
+            # Синхронный интерфейс движка: диалект, события SQLAlchemy
+            self.engine = self.backend.engine.sync_engine
+        self.states = StateCache(
+            self._load_state,
+            self._save_states,
+            max_size=state_cache_size,
+            ttl=state_ttl,
+            flush_interval=state_flush_interval,
+            write_through=state_write_through,
+        )
+        # Просмотренные кандидаты кэшируются и записываются так же, как состояния
+        self.seen = StateCache(
+            self._load_seen,
+            self._save_seen,
+            max_size=state_cache_size,
+            ttl=state_ttl,
+            flush_interval=state_flush_interval,
+            write_through=state_write_through,
+        )
+
+    def _run(self, func, *args):
+        """Выполняет func(session, *args) из database.queries в новой сессии."""
+        if self.backend is not None:
+            return self.loop.run(self.backend.run(func, *args))
+        with self.Session() as session:
+            return func(session, *args)
+
+    def migrate(self):
+        """Создаёт таблицы и индексы и переносит состояния старого формата.
 
+        Возвращает число пользователей, чьи состояния были перенесены.
+        """
+        if self.backend is not None:
+            self.loop.run(self.backend.create_schema())
+        else:
+            with self.engine.begin() as connection:
+                queries.create_schema(connection)
+        return self.migrate_legacy_states()
+
+    @timed(DB_SECONDS, DB_ERRORS)
     def get_or_create_user(self, vk_id):
         """Получает или создаёт пользователя по VK ID."""
-        with self.Session() as session:
-            user = session.query(User).filter_by(vk_id=vk_id).first()
-            if not user:
-                user = User(vk_id=vk_id)
-                session.add(user)
-                session.commit()
-                session.refresh(user)
-            return user
+        return self._run(queries.get_or_create_user, vk_id)
 
+    @timed(DB_SECONDS, DB_ERRORS)
     def save_user_state(self, vk_id, state):
-        """Сохраняет состояние диалога пользователя."""
-        with self.Session() as session:
-            user = session.query(User).filter_by(vk_id=vk_id).first()
-            if user:
-                user.state = json.dumps(state, ensure_ascii=False)
-                session.commit()
+        """Сохраняет состояние диалога пользователя (через кэш)."""
+        self.states.set(vk_id, state)
 
+    @timed(DB_SECONDS, DB_ERRORS)
     def load_user_state(self, vk_id):
-        """Загружает состояние диалога пользователя."""
-        with self.Session() as session:
-            user = session.query(User).filter_by(vk_id=vk_id).first()
-            if user and user.state:
-                return json.loads(user.state)
-            return None
+        """Загружает состояние диалога пользователя (через кэш)."""
+        return self.states.get(vk_id)
 
-    def get_or_create_candidate(
-        self, vk_id, first_name, last_name, profile_url, photos
-    ):
-        """Получает или создаёт кандидата по VK ID."""
-        with self.Session() as session:
-            candidate = session.query(Candidate).filter_by(vk_id=vk_id).first()
-            if not candidate:
-                candidate = Candidate(
-                    vk_id=vk_id,
-                    first_name=first_name,
-                    last_name=last_name,
-                    profile_url=profile_url,
-                    photos=json.dumps(photos, ensure_ascii=False),
-                )
-                session.add(candidate)
-                session.commit()
-                session.refresh(candidate)
-            return candidate
+    @timed(DB_SECONDS, DB_ERRORS)
+    def _load_state(self, vk_id):
+        """Читает состояние диалога из БД."""
+        return self._run(queries.load_state, vk_id)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def migrate_legacy_states(self):
+        """Переносит кандидатов из всех состояний старого формата в очередь.
+
+        Возвращает число обновлённых пользователей.
+        """
+        self.flush()
+        migrated = self._run(queries.migrate_legacy_states)
+        for vk_id in migrated:
+            self.states.invalidate(vk_id)
+        return len(migrated)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def get_popular_searches(self, limit=20, shards=1, shard=0):
+        """Возвращает самые частые критерии поиска из сохранённых состояний.
+
+        Каждый элемент — словарь state["search"] (age_from, age_to, sex, city_id).
+        При shards > 1 учитываются только пользователи шарда shard.
+        """
+        return self._run(queries.get_popular_searches, limit, shards, shard)
 
+    @timed(DB_SECONDS, DB_ERRORS)
+    def _save_states(self, states):
+        """Записывает пачку состояний {vk_id: state} одним запросом."""
+        self._run(queries.save_states, states)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def extend_queue(self, user_vk_id, candidates, start):
+        """Дописывает следующую страницу кандидатов в очередь с номера start."""
+        self._run(queries.fill_queue, user_vk_id, candidates, start)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def get_queue_items(self, user_vk_id, start, count):
+        """Возвращает до count кандидатов из очереди, начиная с номера start."""
+        return self._run(queries.get_queue_items, user_vk_id, start, count)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def get_queue_item(self, user_vk_id, position):
+        """Возвращает кандидата из очереди по номеру (None — очередь кончилась)."""
+        items = self.get_queue_items(user_vk_id, position, 1)
+        return items[0] if items else None
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def get_cities(self):
+        """Возвращает все сохранённые города."""
+        return self._run(queries.get_cities)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def save_cities(self, cities):
+        """Сохраняет города из ответа database.getCities, пропуская известные."""
+        if cities:
+            self._run(queries.save_cities, cities)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def get_seen(self, user_vk_id):
+        """Возвращает множество VK ID кандидатов, уже показанных пользователю."""
+        return self.seen.get(user_vk_id)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def mark_seen(self, user_vk_id, candidate_vk_id):
+        """Отмечает кандидата как показанного пользователю."""
+        seen = self.seen.get(user_vk_id)
+        if candidate_vk_id not in seen:
+            seen.add(candidate_vk_id)
+            self.seen.set(user_vk_id, seen)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def _load_seen(self, vk_id):
+        """Читает множество просмотренных из БД."""
+        return self._run(queries.load_seen, vk_id)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def _save_seen(self, seen):
+        """Записывает пачку множеств {vk_id: set} одним пакетным upsert."""
+        self._run(queries.save_seen, seen)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def flush(self):
+        """Записывает в БД все отложенные изменения состояний."""
+        self.states.flush()
+        self.seen.flush()
+
+    def close(self):
+        """Сохраняет отложенные изменения и закрывает пул соединений."""
+        self.states.close()
+        self.seen.close()
+        if self.backend is not None:
+            self.loop.run(self.backend.close())
+        else:
+            self.engine.dispose()
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def save_candidates(self, candidates):
+        """Сохраняет страницу результатов поиска одним INSERT ... ON CONFLICT.
+
+        Новые кандидаты записываются без фото (их дописывает
+        update_candidate_photos), у известных обновляются имя и фамилия.
+        """
+        if candidates:
+            self._run(queries.save_candidates, candidates)
+
+    @timed(DB_SECONDS, DB_ERRORS)
+    def update_candidate_photos(self, photos):
+        """Записывает фото кандидатов {vk_id: [...]} одним пакетным UPDATE."""
+        if photos:
+            self._run(queries.update_candidate_photos, photos)
+
+    @timed(DB_SECONDS, DB_ERRORS)
     def add_to_favorites(
         self, user_vk_id, candidate_vk_id, first_name, last_name, profile_url, photos
     ):
-        """Добавляет кандидата в избранное пользователя."""
-        user = self.get_or_create_user(user_vk_id)
-        candidate = self.get_or_create_candidate(
-            candidate_vk_id, first_name, last_name, profile_url, photos
-        )
+        """Добавляет кандидата в избранное пользователя.
 
-        with self.Session() as session:
-            exists = (
-                session.query(Favorite)
-                .filter_by(user_id=user.id, candidate_id=candidate.id)
-                .first()
-            )
-            if exists:
-                return False
+        Кандидат сохраняется (или обновляются его фото), а запись избранного
+        вставляется через ON CONFLICT DO NOTHING в одной транзакции, поэтому
+        одновременные нажатия не создают дублей. В PostgreSQL всё выполняется
+        одним запросом. Возвращает False, если кандидат уже был в избранном.
+        """
+        return self._run(
+            queries.add_to_favorites,
+            user_vk_id,
+            candidate_vk_id,
+            first_name,
+            last_name,
+            profile_url,
+            photos,
+        )
 
-            favorite = Favorite(user_id=user.id, candidate_id=candidate.id)
-            session.add(favorite)
-            session.commit()
-            return True
+    @timed(DB_SECONDS, DB_ERRORS)
+    def get_favorites(self, user_vk_id, limit=None, after=None, before=None):
+        """Возвращает список избранных кандидатов пользователя.
 
-    def get_favorites(self, user_vk_id):
-        """Возвращает список избранных кандидатов пользователя."""
-        with self.Session() as session:
-            user = session.query(User).filter_by(vk_id=user_vk_id).first()
-            if not user:
-                return []
-
-            favorites = []
-            for fav in user.favorites:
-                candidate = fav.candidate
-                favorites.append(
-                    {
-                        "vk_id": candidate.vk_id,
-                        "first_name": candidate.first_name,
-                        "last_name": candidate.last_name,
-                        "profile_url": candidate.profile_url,
-                        "photos": json.loads(candidate.photos),
-                        "added": fav.added,
-                    }
-                )
-            return favorites
+        Избранное читается одним запросом в порядке добавления. Для постраничного
+        вывода передайте limit и after — поле cursor последней записи
+        предыдущей страницы — или before (cursor первой записи следующей
+        страницы), чтобы получить limit записей перед ней.
+        """
+        return self._run(queries.get_favorites, user_vk_id, limit, after, before)
@@ -1,5 +1,5 @@
-from sqlalchemy import (Column, DateTime, ForeignKey, Integer, String, Text,
-                        UniqueConstraint, func)
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index, Integer,
+                        LargeBinary, String, Text, UniqueConstraint, func)
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -47,4 +47,43 @@ class Favorite(Base):
     user = relationship("User", back_populates="favorites")
     candidate = relationship("Candidate", back_populates="favorites")
 
-    __table_args__ = (UniqueConstraint("user_id", "candidate_id"),)
+    __table_args__ = (
+        UniqueConstraint("user_id", "candidate_id"),
+        # Чтение избранного пользователя в порядке добавления (id растёт с added)
+        Index("ix_favorites_user_id_id", "user_id", "id"),
+    )
+
+
+class QueueItem(Base):
+    """Кандидат в очереди показа пользователя."""
+
+    __tablename__ = "queue_items"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    position = Column(Integer, nullable=False)
+    vk_id = Column(Integer, nullable=False)
+    first_name = Column(String(50), nullable=False)
+    last_name = Column(String(50), nullable=False)
+
+    __table_args__ = (UniqueConstraint("user_id", "position"),)
+
+
+class City(Base):
+    """Город из справочника VK (заполняется по мере поиска)."""
+
+    __tablename__ = "cities"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)  # ID города в VK
+    title = Column(String(100), nullable=False)
+    region = Column(String(200))
+    important = Column(Boolean, nullable=False, default=False)
+
+
+class SeenSet(Base):
+    """Кандидаты, которых пользователь уже видел (для фильтрации новых поисков)."""
+
+    __tablename__ = "seen_sets"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    ids = Column(LargeBinary, nullable=False)  # отсортированный массив VK ID (int64)
@@ -0,0 +1,434 @@
+"""Запросы к БД, общие для синхронного и асинхронного менеджеров.
+
+Каждая функция принимает открытую сессию (Session) и сама фиксирует
+транзакцию. DatabaseManager вызывает их напрямую, AsyncDatabaseManager —
+через AsyncSession.run_sync. Частые запросы собраны заранее с параметрами
+bindparam: SQLAlchemy не пересобирает их при каждом вызове, а asyncpg
+и sqlite3 берут готовые подготовленные выражения из своего кэша.
+"""
+import json
+import sys
+from array import array
+from collections import Counter
+
+from sqlalchemy import (LargeBinary, bindparam, case, insert, literal, select,
+                        true)
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database.models import (Base, Candidate, City, Favorite, QueueItem,
+                             SeenSet, User)
+
+LOAD_STATE = select(User.id, User.state).where(User.vk_id == bindparam("vk_id"))
+SAVE_STATES = (
+    User.__table__.update()
+    .where(User.__table__.c.vk_id == bindparam("b_vk_id"))
+    .values(state=bindparam("b_state"))
+)
+USER_ID = select(User.id).where(User.vk_id == bindparam("vk_id"))
+QUEUE_ITEMS = (
+    select(QueueItem.vk_id, QueueItem.first_name, QueueItem.last_name)
+    .join(User, User.id == QueueItem.user_id)
+    .where(
+        User.vk_id == bindparam("vk_id"),
+        QueueItem.position >= bindparam("start"),
+        QueueItem.position < bindparam("end"),
+    )
+    .order_by(QueueItem.position)
+)
+LOAD_SEEN = (
+    select(SeenSet.ids)
+    .join(User, User.id == SeenSet.user_id)
+    .where(User.vk_id == bindparam("vk_id"))
+)
+FAVORITE_IDS = (
+    select(Candidate.vk_id)
+    .join(Favorite, Favorite.candidate_id == Candidate.id)
+    .join(User, User.id == Favorite.user_id)
+    .where(User.vk_id == bindparam("vk_id"))
+)
+
+_dialects = {"postgresql": postgresql, "sqlite": sqlite}
+_statements = {}  # (имя, диалект) -> собранный запрос
+
+
+def _dialect(session):
+    """Возвращает имя СУБД, с которой работает сессия."""
+    return session.get_bind().dialect.name
+
+
+def _upsert(session, model):
+    """Возвращает INSERT с поддержкой ON CONFLICT для СУБД сессии."""
+    return _dialects.get(_dialect(session), postgresql).insert(model)
+
+
+def _statement(session, name, build):
+    """Собирает запрос, зависящий от СУБД, один раз на каждый диалект."""
+    key = (name, _dialect(session))
+    stmt = _statements.get(key)
+    if stmt is None:
+        stmt = _statements[key] = build(session)
+    return stmt
+
+
+def create_schema(connection):
+    """Создаёт таблицы и индексы, добавленные в модели после создания таблиц."""
+    Base.metadata.create_all(connection)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def get_or_create_user(session, vk_id):
+    """Получает или создаёт пользователя по VK ID."""
+    user = session.query(User).filter_by(vk_id=vk_id).first()
+    if not user:
+        user = User(vk_id=vk_id)
+        session.add(user)
+        session.commit()
+        session.refresh(user)
+    return user
+
+
+def load_state(session, vk_id):
+    """Читает состояние диалога, перенося кандидатов из старого формата."""
+    user = session.execute(LOAD_STATE, {"vk_id": vk_id}).first()
+    if not user or not user.state:
+        return None
+    state = json.loads(user.state)
+    if "candidates" in state:
+        state = _migrate_state(session, user.id, state)
+        session.commit()
+    return state
+
+
+def _migrate_state(session, user_id, state):
+    """Переносит список кандидатов из старого формата состояния в очередь."""
+    _fill_queue(session, user_id, state.pop("candidates"))
+    session.query(User).filter_by(id=user_id).update(
+        {"state": json.dumps(state, ensure_ascii=False)}
+    )
+    return state
+
+
+def migrate_legacy_states(session):
+    """Переносит кандидатов из всех состояний старого формата в очередь.
+
+    Возвращает VK ID пользователей, чьи состояния изменились.
+    """
+    rows = (
+        session.query(User.id, User.vk_id, User.state)
+        .filter(User.state.like('%"candidates"%'))
+        .all()
+    )
+    migrated = []
+    for row in rows:
+        state = json.loads(row.state)
+        if "candidates" in state:
+            _migrate_state(session, row.id, state)
+            migrated.append(row.vk_id)
+    session.commit()
+    return migrated
+
+
+def get_popular_searches(session, limit, shards=1, shard=0):
+    """Возвращает самые частые критерии поиска из сохранённых состояний.
+
+    При shards > 1 учитываются только пользователи шарда shard (vk_id % shards).
+    """
+    counts = Counter()
+    query = session.query(User.state).filter(User.state.like('%"search"%'))
+    if shards > 1:
+        query = query.filter(User.vk_id % shards == shard)
+    rows = query.yield_per(1000)
+    for row in rows:
+        search = json.loads(row.state).get("search")
+        if search:
+            counts[tuple(sorted(search.items()))] += 1
+    return [dict(key) for key, _ in counts.most_common(limit)]
+
+
+def save_states(session, states):
+    """Записывает пачку состояний {vk_id: state} одним запросом."""
+    params = [
+        {"b_vk_id": vk_id, "b_state": json.dumps(state, ensure_ascii=False)}
+        for vk_id, state in states.items()
+    ]
+    session.execute(SAVE_STATES, params)
+    session.commit()
+
+
+def _fill_queue(session, user_id, candidates, start=0):
+    """Записывает кандидатов в очередь с номера start, удаляя всё после него."""
+    session.query(QueueItem).filter(
+        QueueItem.user_id == user_id, QueueItem.position >= start
+    ).delete()
+    if candidates:
+        session.execute(
+            insert(QueueItem),
+            [
+                {
+                    "user_id": user_id,
+                    "position": position,
+                    "vk_id": person["id"],
+                    "first_name": person["first_name"][:50],
+                    "last_name": person["last_name"][:50],
+                }
+                for position, person in enumerate(candidates, start)
+            ],
+        )
+
+
+def fill_queue(session, user_vk_id, candidates, start=0):
+    """Записывает кандидатов в очередь пользователя с номера start."""
+    user_id = session.execute(USER_ID, {"vk_id": user_vk_id}).scalar()
+    if user_id is None:
+        return
+    _fill_queue(session, user_id, candidates, start)
+    session.commit()
+
+
+def get_queue_items(session, user_vk_id, start, count):
+    """Возвращает до count кандидатов из очереди, начиная с номера start."""
+    items = session.execute(
+        QUEUE_ITEMS, {"vk_id": user_vk_id, "start": start, "end": start + count}
+    )
+    return [
+        {
+            "id": item.vk_id,
+            "first_name": item.first_name,
+            "last_name": item.last_name,
+        }
+        for item in items
+    ]
+
+
+def get_cities(session):
+    """Возвращает все сохранённые города."""
+    return [
+        {
+            "id": city.id,
+            "title": city.title,
+            "region": city.region,
+            "important": city.important,
+        }
+        for city in session.query(City).all()
+    ]
+
+
+def save_cities(session, cities):
+    """Сохраняет города из ответа database.getCities, пропуская известные."""
+    rows = {
+        city["id"]: {
+            "id": city["id"],
+            "title": city["title"],
+            "region": city.get("region"),
+            "important": bool(city.get("important")),
+        }
+        for city in cities
+    }
+    stmt = _upsert(session, City).on_conflict_do_nothing(index_elements=["id"])
+    session.execute(stmt, list(rows.values()))
+    session.commit()
+
+
+def load_seen(session, vk_id):
+    """Читает множество просмотренных кандидатов.
+
+    Если его ещё нет, начинает с избранного пользователя (оно заведомо
+    просмотрено), читая только ID.
+    """
+    ids = session.execute(LOAD_SEEN, {"vk_id": vk_id}).scalar()
+    if ids is not None:
+        return _unpack_ids(ids)
+    return set(session.execute(FAVORITE_IDS, {"vk_id": vk_id}).scalars())
+
+
+def _build_save_seen(session):
+    """Собирает пакетный upsert множеств просмотренных."""
+    # Core-таблица: ORM не поддерживает пакетный INSERT ... SELECT
+    stmt = _upsert(session, SeenSet.__table__).from_select(
+        ["user_id", "ids"],
+        select(User.id, bindparam("b_ids", type_=LargeBinary)).where(
+            User.vk_id == bindparam("b_vk_id")
+        ),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id"], set_={"ids": stmt.excluded.ids}
+    )
+
+
+def save_seen(session, seen):
+    """Записывает пачку множеств {vk_id: set} одним пакетным upsert."""
+    params = [
+        {"b_vk_id": vk_id, "b_ids": _pack_ids(ids)} for vk_id, ids in seen.items()
+    ]
+    session.execute(_statement(session, "save_seen", _build_save_seen), params)
+    session.commit()
+
+
+def save_candidates(session, candidates):
+    """Сохраняет страницу результатов поиска одним INSERT ... ON CONFLICT."""
+    rows = {
+        person["id"]: {
+            "vk_id": person["id"],
+            "first_name": person["first_name"][:50],
+            "last_name": person["last_name"][:50],
+            "profile_url": f"vk.com/id{person['id']}",
+            "photos": "[]",
+        }
+        for person in candidates
+    }
+    stmt = _upsert(session, Candidate)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["vk_id"],
+        set_={
+            "first_name": stmt.excluded.first_name,
+            "last_name": stmt.excluded.last_name,
+        },
+    )
+    session.execute(stmt, list(rows.values()))
+    session.commit()
+
+
+def update_candidate_photos(session, photos):
+    """Записывает фото кандидатов {vk_id: [...]} одним пакетным UPDATE."""
+    stmt = (
+        Candidate.__table__.update()
+        .where(Candidate.__table__.c.vk_id == bindparam("b_vk_id"))
+        .values(photos=bindparam("b_photos"))
+    )
+    params = [
+        {"b_vk_id": vk_id, "b_photos": json.dumps(items, ensure_ascii=False)}
+        for vk_id, items in photos.items()
+    ]
+    session.execute(stmt, params)
+    session.commit()
+
+
+def _build_upsert_candidate(session):
+    """Собирает upsert кандидата, возвращающий его id.
+
+    Пустой список фото (не удалось загрузить) не затирает уже сохранённые.
+    Строка обновляется в любом случае: иначе RETURNING не вернёт id.
+    """
+    # Core-таблицы: ORM принял бы словарь параметров за пакетную вставку
+    table = Candidate.__table__
+    stmt = _upsert(session, table).values(
+        vk_id=bindparam("candidate_vk_id"),
+        first_name=bindparam("first_name"),
+        last_name=bindparam("last_name"),
+        profile_url=bindparam("profile_url"),
+        photos=bindparam("photos"),
+    )
+    photos = case(
+        (stmt.excluded.photos == "[]", table.c.photos), else_=stmt.excluded.photos
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["vk_id"], set_={"photos": photos}
+    ).returning(table.c.id)
+
+
+def _build_add_favorite(session, candidate_id=None):
+    """Собирает вставку избранного, пропускающую уже добавленных.
+
+    В PostgreSQL upsert кандидата входит в тот же запрос (CTE), иначе
+    передаётся готовый candidate_id.
+    """
+    if candidate_id is None:
+        candidate = _build_upsert_candidate(session).cte("candidate")
+        # CTE возвращает одну строку: соединение без условия тут намеренное
+        users = select(User.id, candidate.c.id).join_from(User, candidate, true())
+    else:
+        users = select(User.id, candidate_id)
+    return (
+        _upsert(session, Favorite.__table__)
+        .from_select(
+            ["user_id", "candidate_id"],
+            users.where(User.vk_id == bindparam("user_vk_id")),
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "candidate_id"])
+        .returning(Favorite.__table__.c.id)
+    )
+
+
+def add_to_favorites(
+    session, user_vk_id, candidate_vk_id, first_name, last_name, profile_url, photos
+):
+    """Добавляет кандидата в избранное; False — он там уже был."""
+    params = {
+        "user_vk_id": user_vk_id,
+        "candidate_vk_id": candidate_vk_id,
+        "first_name": first_name,
+        "last_name": last_name,
+        "profile_url": profile_url,
+        "photos": json.dumps(photos, ensure_ascii=False),
+    }
+    if _dialect(session) == "postgresql":
+        favorite = _statement(session, "add_favorite", _build_add_favorite)
+    else:
+        candidate = _statement(session, "upsert_candidate", _build_upsert_candidate)
+        candidate_id = session.execute(candidate, params).scalar_one()
+        favorite = _build_add_favorite(session, literal(candidate_id))
+    added = session.execute(favorite, params).first() is not None
+    session.commit()
+    return added
+
+
+def get_favorites(session, user_vk_id, limit=None, after=None, before=None):
+    """Возвращает избранное пользователя в порядке добавления (см. менеджер)."""
+    query = (
+        session.query(
+            Favorite.id,
+            Favorite.added,
+            Candidate.vk_id,
+            Candidate.first_name,
+            Candidate.last_name,
+            Candidate.profile_url,
+            Candidate.photos,
+        )
+        .join(Candidate, Candidate.id == Favorite.candidate_id)
+        .join(User, User.id == Favorite.user_id)
+        .filter(User.vk_id == user_vk_id)
+    )
+    if after is not None:
+        query = query.filter(Favorite.id > after)
+    if before is not None:
+        # Берём ближайшие записи перед курсором и разворачиваем обратно
+        query = query.filter(Favorite.id < before).order_by(Favorite.id.desc())
+    else:
+        query = query.order_by(Favorite.id)
+    if limit is not None:
+        query = query.limit(limit)
+    rows = query.all()
+    if before is not None:
+        rows.reverse()
+
+    return [
+        {
+            "vk_id": row.vk_id,
+            "first_name": row.first_name,
+            "last_name": row.last_name,
+            "profile_url": row.profile_url,
+            "photos": json.loads(row.photos),
+            "added": row.added,
+            "cursor": row.id,
+        }
+        for row in rows
+    ]
+
+
+def _pack_ids(ids):
+    """Упаковывает множество ID в отсортированный массив int64 (little-endian)."""
+    packed = array("q", sorted(ids))
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack_ids(data):
+    """Распаковывает массив, записанный _pack_ids, в множество."""
+    ids = array("q")
+    ids.frombytes(data)
+    if sys.byteorder != "little":
+        ids.byteswap()
+    return set(ids)
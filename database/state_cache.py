@@ -0,0 +1,145 @@
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class StateCache:
+    """Кэш состояний диалога с вытеснением LRU+TTL и отложенной записью в БД.
+
+    Изменённые состояния помечаются «грязными» и записываются в БД пачкой
+    фоновым потоком раз в flush_interval секунд. В режиме write_through
+    каждое сохранение сразу уходит в БД.
+    """
+
+    def __init__(
+        self,
+        load,
+        save_many,
+        max_size=10000,
+        ttl=600,
+        flush_interval=1.0,
+        write_through=False,
+    ):
+        """Принимает функции чтения одного состояния и записи пачки состояний."""
+        self._load = load
+        self._save_many = save_many
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.write_through = write_through
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()  # vk_id -> (state, время загрузки)
+        self._dirty = {}  # vk_id -> state, ещё не записанные в БД
+        self._flushing = {}  # vk_id -> state, записываемые прямо сейчас
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if not write_through:
+            self._thread = threading.Thread(
+                target=self._flush_loop, name="state-flusher", daemon=True
+            )
+            self._thread.start()
+
+    def _put(self, vk_id, state):
+        """Кладёт состояние в кэш и вытесняет самые старые записи."""
+        self._entries[vk_id] = (state, time.monotonic())
+        self._entries.move_to_end(vk_id)
+        while len(self._entries) > self.max_size:
+            # Грязные записи остаются в _dirty до сброса, поэтому не теряются
+            self._entries.popitem(last=False)
+
+    def _lookup(self, vk_id):
+        """Ищет состояние в памяти, не обращаясь к БД."""
+        for pending in (self._dirty, self._flushing):
+            if vk_id in pending:
+                return pending[vk_id]
+        entry = self._entries.get(vk_id)
+        if entry is None:
+            return _MISSING
+        state, loaded_at = entry
+        if time.monotonic() - loaded_at > self.ttl:
+            del self._entries[vk_id]
+            return _MISSING
+        self._entries.move_to_end(vk_id)
+        return state
+
+    def get(self, vk_id):
+        """Возвращает копию состояния, загружая его из БД при промахе."""
+        with self._lock:
+            state = self._lookup(vk_id)
+            if state is not _MISSING:
+                self.hits += 1
+                return copy.deepcopy(state)
+            self.misses += 1
+
+        state = self._load(vk_id)
+        with self._lock:
+            # Пока шёл запрос, состояние могли сохранить — оно свежее БД
+            cached = self._lookup(vk_id)
+            if cached is not _MISSING:
+                return copy.deepcopy(cached)
+            self._put(vk_id, state)
+        return copy.deepcopy(state)
+
+    def set(self, vk_id, state):
+        """Сохраняет состояние в кэш и помечает его для записи в БД."""
+        state = copy.deepcopy(state)
+        if self.write_through:
+            self._save_many({vk_id: state})
+            with self._lock:
+                self._put(vk_id, state)
+            return
+        with self._lock:
+            self._put(vk_id, state)
+            self._dirty[vk_id] = state
+
+    def invalidate(self, vk_id):
+        """Удаляет состояние из кэша (несохранённые изменения сохраняются)."""
+        with self._lock:
+            self._entries.pop(vk_id, None)
+
+    def dirty_count(self):
+        """Возвращает число состояний, ожидающих записи."""
+        with self._lock:
+            return len(self._dirty)
+
+    def flush(self):
+        """Записывает все грязные состояния в БД одной пачкой."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._flushing, self._dirty = self._dirty, {}
+            try:
+                self._save_many(self._flushing)
+            except Exception:
+                with self._lock:
+                    # Вернём неудачную пачку, не затирая более свежие изменения
+                    for vk_id, state in self._flushing.items():
+                        self._dirty.setdefault(vk_id, state)
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def _flush_loop(self):
+        """Периодически сбрасывает грязные состояния в БД."""
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Ошибка записи состояний в БД: {e}")
+
+    def close(self):
+        """Останавливает фоновый поток и записывает оставшиеся изменения."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
@@ -0,0 +1,85 @@
+import logging
+import queue
+import threading
+
+_STOP = object()
+
+
+class EventDispatcher:
+    """Раздаёт входящие сообщения пулу потоков, сохраняя порядок для каждого user_id.
+
+    Каждый пользователь закрепляется за одной очередью по хешу user_id,
+    поэтому его сообщения обрабатываются строго последовательно, а разные
+    пользователи не ждут друг друга.
+    """
+
+    def __init__(self, handler, workers=8, queue_size=100, put_timeout=None):
+        """Запускает worker-потоки с ограниченными очередями."""
+        self.handler = handler
+        self.put_timeout = put_timeout
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = []
+        self._closed = False
+        for i, q in enumerate(self.queues):
+            thread = threading.Thread(
+                target=self._worker, args=(q,), name=f"dispatcher-{i}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def _queue_for(self, user_id):
+        """Возвращает очередь, за которой закреплён пользователь."""
+        return self.queues[hash(user_id) % len(self.queues)]
+
+    def submit(self, user_id, text):
+        """Ставит сообщение в очередь пользователя.
+
+        Если очередь заполнена, вызывающий поток блокируется (backpressure).
+        При заданном put_timeout сообщение отбрасывается по истечении времени,
+        и метод возвращает False.
+        """
+        if self.try_submit(user_id, text, self.put_timeout):
+            return True
+        logging.warning(f"Очередь переполнена, сообщение {user_id} отброшено")
+        return False
+
+    def try_submit(self, user_id, text, timeout=None):
+        """Ставит сообщение в очередь пользователя, ожидая места не дольше timeout.
+
+        Возвращает False, если за это время очередь не освободилась.
+        """
+        if self._closed:
+            raise RuntimeError("Диспетчер остановлен")
+        try:
+            self._queue_for(user_id).put((user_id, text), timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def queue_sizes(self):
+        """Возвращает текущую глубину каждой очереди."""
+        return [q.qsize() for q in self.queues]
+
+    def _worker(self, q):
+        """Последовательно обрабатывает сообщения из одной очереди."""
+        while True:
+            item = q.get()
+            try:
+                if item is _STOP:
+                    return
+                user_id, text = item
+                self.handler(user_id, text)
+            except Exception as e:
+                logging.exception(f"Ошибка обработки сообщения: {e}")
+            finally:
+                q.task_done()
+
+    def shutdown(self, timeout=None):
+        """Дожидается обработки уже принятых сообщений и останавливает потоки."""
+        if self._closed:
+            return
+        self._closed = True
+        for q in self.queues:
+            q.put(_STOP)
+        for thread in self.threads:
+            thread.join(timeout)
@@ -36,3 +36,20 @@ def get_start_button():
     keyboard = VkKeyboard(one_time=True)
     keyboard.add_button("/start", color=VkKeyboardColor.SECONDARY)
     return keyboard.get_keyboard()
+
+
+def get_favorites_keyboard(has_prev, has_next):
+    """Клавиатура листания избранного: Предыдущие/Следующие, Дальше, Новый поиск"""
+    keyboard = VkKeyboard(one_time=False)
+
+    if has_prev or has_next:
+        if has_prev:
+            keyboard.add_button("Предыдущие", color=VkKeyboardColor.SECONDARY)
+        if has_next:
+            keyboard.add_button("Следующие", color=VkKeyboardColor.SECONDARY)
+        keyboard.add_line()
+
+    keyboard.add_button("Дальше", color=VkKeyboardColor.PRIMARY)
+    keyboard.add_button("Новый поиск", color=VkKeyboardColor.NEGATIVE)
+
+    return keyboard.get_keyboard()
@@ -1,43 +1,345 @@
+import functools
 import logging
-import time
+import sys
 
-from vk_api import VkApi, VkApiError
-from vk_api.longpoll import VkEventType, VkLongPoll
-
-from config import DATABASE_URL, GROUP_TOKEN, USER_TOKEN
+import metrics
+from cache import TTLCache
+from config import (DATABASE_URL, DB_ASYNC, DB_MAX_OVERFLOW, DB_POOL_SIZE,
+                    DB_POOL_TIMEOUT, DB_STATEMENT_CACHE_SIZE,
+                    FAVORITES_PAGE_SIZE, GROUP_RATE_LIMIT, GROUP_TOKEN,
+                    METRICS_HOST, METRICS_PORT, OUTBOX_MERGE, OUTBOX_RETRIES,
+                    PHOTO_CACHE_SIZE, PHOTO_CACHE_TTL, PHOTO_PREFETCH,
+                    PREWARM_BUDGET, PREWARM_HOURS, PREWARM_INTERVAL,
+                    PREWARM_PAGES, PREWARM_PHOTOS, PREWARM_TOP, PREWARM_TTL,
+                    RESTART_DELAY, RESTART_MAX_DELAY, SEARCH_CACHE_SIZE,
+                    SEARCH_CACHE_TTL, SHARD_HEALTH_TIMEOUT, SHARDS,
+                    SLOW_CALL_THRESHOLD, STATE_CACHE_SIZE, STATE_CACHE_TTL,
+                    STATE_FLUSH_INTERVAL, STATE_WRITE_THROUGH, USER_TOKENS,
+                    VK_API_URL, VK_BATCH_WINDOW, VK_RATE_LIMIT,
+                    WORKER_QUEUE_SIZE, WORKERS_COUNT)
 from database.manager import DatabaseManager
+from dispatcher import EventDispatcher
+from outbox import AsyncOutbox, Outbox
+from prewarmer import Prewarmer
+from sharding import ShardedDispatcher
+from supervisor import supervise
 from user_bot import UserBot
+from vk_async import (AsyncBotsLongPoll, AsyncVkClient, BatchingClient,
+                      EventLoopThread, VkApiProxy)
+from vk_scheduler import VkScheduler
 from vk_searcher import VkSearcher
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 
-def main():
-    db = DatabaseManager(DATABASE_URL)  # Инициализируем БД до цикла
+def register_cache_metrics(caches):
+    """Публикует статистику кэшей {имя: кэш с полями hits и misses}."""
+
+    def ratio(cache):
+        total = cache.hits + cache.misses
+        return cache.hits / total if total else 0
+
+    for name, documentation, func, kind in (
+        ("cache_hits_total", "Попадания в кэш", lambda c: c.hits, "counter"),
+        ("cache_misses_total", "Промахи кэша", lambda c: c.misses, "counter"),
+        ("cache_hit_ratio", "Доля попаданий в кэш", ratio, "gauge"),
+    ):
+        metrics.REGISTRY.collect(
+            name,
+            documentation,
+            lambda func=func: {(n,): func(c) for n, c in caches.items()},
+            ["cache"],
+            kind,
+        )
+
+
+def register_dispatcher_metrics(dispatcher):
+    """Публикует глубину очередей диспетчера."""
+    metrics.REGISTRY.collect(
+        "dispatcher_queue_depth",
+        "Сообщения, ожидающие обработки, по очередям диспетчера",
+        lambda: {(str(i),): n for i, n in enumerate(dispatcher.queue_sizes())},
+        ["queue"],
+    )
+
+
+def register_bot_metrics(db, outbox, searcher, group_client):
+    """Публикует глубину очередей и статистику отправки бота и его поисковика."""
+    collect = metrics.REGISTRY.collect
+    collect(
+        "vk_waiting_calls",
+        "Вызовы VK, ожидающие свободного токена",
+        lambda: {
+            ("user",): searcher.searcher.client.queue_size(),
+            ("group",): group_client.queue_size(),
+        },
+        ["token"],
+    )
+    collect("outbox_pending", "Сообщения в очереди отправки", outbox.pending)
+    collect(
+        "outbox_messages_total",
+        "Исходящие сообщения по результату",
+        lambda: {("sent",): outbox.outbox.sent, ("failed",): outbox.outbox.failed},
+        ["result"],
+        "counter",
+    )
+    collect(
+        "db_dirty_entries",
+        "Изменения, ожидающие записи в БД",
+        lambda: {
+            ("states",): db.states.dirty_count(),
+            ("seen",): db.seen.dirty_count(),
+        },
+        ["cache"],
+    )
+
+
+def start_metrics(port, caches=None):
+    """Публикует статистику кэшей (если они есть) и запускает эндпоинт метрик."""
+    metrics.set_slow_threshold(SLOW_CALL_THRESHOLD)
+    if caches:
+        register_cache_metrics(caches)
+    if port:
+        metrics.start_http_server(port, METRICS_HOST)
+        logging.info(f"Метрики: http://{METRICS_HOST}:{port}/metrics")
+
+
+def create_db():
+    """Подключается к БД с настройками пула и кэша состояний из config."""
+    return DatabaseManager(
+        DATABASE_URL,
+        state_cache_size=STATE_CACHE_SIZE,
+        state_ttl=STATE_CACHE_TTL,
+        state_flush_interval=STATE_FLUSH_INTERVAL,
+        state_write_through=STATE_WRITE_THROUGH,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        # Свой цикл событий: запросы к БД не задерживают вызовы VK
+        loop=EventLoopThread() if DB_ASYNC else None,
+    )
+
+
+def create_group_client(share=1):
+    """Клиент с токеном группы; share — доля лимита запросов на процесс."""
+    return VkScheduler(
+        [AsyncVkClient(GROUP_TOKEN, VK_API_URL)], rate=GROUP_RATE_LIMIT / share
+    )
+
 
-    while True:
-        try:
-            group_session = VkApi(token=GROUP_TOKEN)
-            group_session.get_api().users.get(user_ids=1)  # Проверка токена
-            vk = group_session.get_api()
-            longpoll = VkLongPoll(group_session)
+def shard_tokens(shard=0, shards=1):
+    """Возвращает токены пользователя шарда и долю их лимита запросов.
 
-            searcher = VkSearcher(USER_TOKEN)
-            bot = UserBot(vk, searcher, db)  # Передаём один и тот же экземпляр db
+    Если токенов не меньше, чем шардов, каждый шард получает свои токены
+    с полным лимитом; иначе все шарды используют все токены и делят лимит.
+    """
+    if len(USER_TOKENS) >= shards:
+        return USER_TOKENS[shard::shards], 1
+    return USER_TOKENS, shards
+
+
+def check_rate_limits(shards):
+    """Проверяет, что каждому токену в шарде достаётся хотя бы запрос в секунду."""
+    _, share = shard_tokens(0, shards)
+    rates = [VK_RATE_LIMIT / share * weight for _, weight in USER_TOKENS]
+    rates.append(GROUP_RATE_LIMIT / shards)
+    if min(rates) < 1:
+        raise ValueError(
+            f"При SHARDS={shards} на токен в шарде приходится меньше одного "
+            "запроса к VK в секунду: увеличьте VK_RATE_LIMIT и GROUP_RATE_LIMIT, "
+            "добавьте токены в USER_TOKEN или уменьшите SHARDS"
+        )
+
+
+def create_bot(db, loop, photo_cache, search_cache, shard=0, shards=1):
+    """Собирает бота: клиент группы, очередь отправки и поисковик с прогревом.
+
+    Возвращает (bot, group_client, outbox, searcher). shards — число процессов
+    с одними и теми же токенами: лимит токена группы делится между ними,
+    токены пользователя распределяет shard_tokens.
+    """
+    tokens, share = shard_tokens(shard, shards)
+    group_client = create_group_client(shards)
+    outbox = Outbox(
+        AsyncOutbox(
+            BatchingClient(group_client, window=VK_BATCH_WINDOW),
+            merge=OUTBOX_MERGE,
+            retries=OUTBOX_RETRIES,
+        ),
+        loop,
+    )
+    searcher = VkSearcher(
+        tokens,
+        loop=loop,
+        db=db,
+        photo_cache=photo_cache,
+        search_cache=search_cache,
+        batch_window=VK_BATCH_WINDOW,
+        rate_limit=VK_RATE_LIMIT / share,
+        api_url=VK_API_URL,
+    )
+    if PREWARM_INTERVAL:
+        searcher.start_prewarm(
+            Prewarmer(
+                searcher.searcher,
+                # Каждый шард прогревает кэш только для критериев своих
+                # пользователей: кэши у шардов свои
+                functools.partial(db.get_popular_searches, shards=shards, shard=shard),
+                store=db,
+                top=PREWARM_TOP,
+                pages=PREWARM_PAGES,
+                photos=PREWARM_PHOTOS,
+                budget=PREWARM_BUDGET // share,
+                interval=PREWARM_INTERVAL,
+                ttl=PREWARM_TTL,
+                hours=PREWARM_HOURS,
+            )
+        )
+    bot = UserBot(
+        outbox,
+        searcher,
+        db,
+        prefetch=PHOTO_PREFETCH,
+        favorites_page_size=FAVORITES_PAGE_SIZE,
+    )
+    return bot, group_client, outbox, searcher
+
+
+def run_shard(shard):
+    """Создаёт обработчик сообщений в процессе-шарде (см. ShardedDispatcher).
+
+    У шарда своё подключение к БД, цикл событий, кэши и бот; метрики
+    отдаются на порту METRICS_PORT + номер шарда + 1.
+    """
+    db = create_db()
+    loop = EventLoopThread()
+    photo_cache = TTLCache(PHOTO_CACHE_SIZE, PHOTO_CACHE_TTL)
+    search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+    bot, group_client, outbox, searcher = create_bot(
+        db, loop, photo_cache, search_cache, shard=shard, shards=SHARDS
+    )
+    start_metrics(
+        METRICS_PORT and METRICS_PORT + shard + 1,
+        {
+            "photos": photo_cache,
+            "searches": search_cache,
+            "states": db.states,
+            "seen": db.seen,
+        },
+    )
+    register_bot_metrics(db, outbox, searcher, group_client)
+
+    def close():
+        outbox.drain(timeout=30)
+        searcher.close()
+        loop.run(group_client.close())
+        db.close()
+
+    return bot.handle_message, close
+
+
+def migrate():
+    """Создаёт схему БД и переносит данные старого формата."""
+    db = DatabaseManager(DATABASE_URL)
+    try:
+        migrated = db.migrate()
+        logging.info(f"Схема БД готова, перенесено состояний: {migrated}")
+    finally:
+        db.close()
+
+
+def main():
+    # Все компоненты создаются один раз и переживают переподключения Long Poll:
+    # кэши, пулы соединений и очереди сообщений не теряются
+    loop = EventLoopThread()  # Общий цикл событий для всех запросов к VK
+    db = outbox = searcher = None
+    if SHARDS > 1:
+        # Этот процесс только читает Long Poll и раздаёт события,
+        # а сообщения обрабатывают дочерние процессы со своими БД и кэшами
+        check_rate_limits(SHARDS)
+        start_metrics(METRICS_PORT)
+        group_client = create_group_client()
+        dispatcher = ShardedDispatcher(
+            run_shard,
+            shards=SHARDS,
+            workers=WORKERS_COUNT,
+            queue_size=WORKER_QUEUE_SIZE,
+            health_timeout=SHARD_HEALTH_TIMEOUT,
+        )
+        metrics.REGISTRY.collect(
+            "shard_restarts_total",
+            "Перезапуски процессов-шардов",
+            lambda: dispatcher.restarts,
+            kind="counter",
+        )
+    else:
+        db = create_db()
+        photo_cache = TTLCache(PHOTO_CACHE_SIZE, PHOTO_CACHE_TTL)
+        search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+        start_metrics(
+            METRICS_PORT,
+            {
+                "photos": photo_cache,
+                "searches": search_cache,
+                "states": db.states,
+                "seen": db.seen,
+            },
+        )
+        bot, group_client, outbox, searcher = create_bot(
+            db, loop, photo_cache, search_cache
+        )
+        dispatcher = EventDispatcher(
+            bot.handle_message,
+            workers=WORKERS_COUNT,
+            queue_size=WORKER_QUEUE_SIZE,
+        )
+        register_bot_metrics(db, outbox, searcher, group_client)
+    register_dispatcher_metrics(dispatcher)
 
-            logging.info("Бот запущен и слушает сообщения...")
+    vk = VkApiProxy(group_client, loop)
+    longpoll = AsyncBotsLongPoll(group_client)
 
-            for event in longpoll.listen():
-                if event.type == VkEventType.MESSAGE_NEW and event.to_me and event.text:
-                    bot.handle_message(event.user_id, event.text.strip())
+    def read_events():
+        for event in loop.iterate(longpoll.listen()):
+            if event["type"] != "message_new":
+                continue
+            # Начиная с версии API 5.103 сообщение вложено в object["message"],
+            # в более старых версиях Long Poll группы object — само сообщение
+            message = event["object"].get("message", event["object"])
+            if message.get("text"):
+                dispatcher.submit(message["from_id"], message["text"].strip())
 
-        except VkApiError as e:
-            logging.error(f"Ошибка API ВКонтакте: {e}")
-        except Exception as e:
-            logging.error(f"Неожиданная ошибка: {e}")
-        finally:
-            time.sleep(5)  # Пауза перед перезапуском
+    try:
+        # Проверка токена
+        supervise(
+            lambda: vk.users.get(user_ids=1),
+            "token",
+            base_delay=RESTART_DELAY,
+            max_delay=RESTART_MAX_DELAY,
+        )
+        logging.info("Бот запущен и слушает сообщения...")
+        # При сбое переподключается только Long Poll, с того же ts
+        supervise(
+            read_events,
+            "longpoll",
+            on_error=longpoll.reconnect,
+            base_delay=RESTART_DELAY,
+            max_delay=RESTART_MAX_DELAY,
+        )
+    finally:
+        dispatcher.shutdown(timeout=60)  # Дорабатываем уже принятые сообщения
+        if outbox:
+            outbox.drain(timeout=30)  # Досылаем ответы
+        if searcher:
+            searcher.close()
+        loop.run(group_client.close())
+        if db:
+            db.close()  # Сохраняем отложенные состояния диалогов
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["migrate"]:
+        migrate()
+    else:
+        main()
@@ -0,0 +1,299 @@
+import bisect
+import functools
+import logging
+import reprlib
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_repr = reprlib.Repr()
+_repr.maxstring = 80
+_repr.maxother = 80
+
+
+def _escape(value):
+    """Экранирует значение метки для текстового формата Prometheus."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    """Собирает строку меток вида {method="users.search",le="0.1"}."""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+class Counter:
+    """Счётчик событий с метками."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        """Задаёт имя метрики, описание и имена меток."""
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}  # значения меток -> число
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        """Увеличивает счётчик для заданных значений меток."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        """Возвращает текущее значение счётчика."""
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        """Возвращает строки метрики в текстовом формате."""
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {value}"
+            for key, value in values
+        ]
+
+
+class Histogram:
+    """Гистограмма длительностей с метками."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """Задаёт имя метрики, описание, имена меток и границы корзин (сек)."""
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # значения меток -> [счётчики корзин, сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        """Учитывает одно измерение."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels):
+        """Возвращает число измерений для заданных значений меток."""
+        with self._lock:
+            entry = self._values.get(labels)
+            return entry[2] if entry else 0
+
+    def samples(self):
+        """Возвращает строки метрики в текстовом формате (корзины накопительные)."""
+        with self._lock:
+            values = [
+                (key, list(counts), total, count)
+                for key, (counts, total, count) in self._values.items()
+            ]
+        lines = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                labels = _format_labels(self.labels, key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Collector:
+    """Метрика, значения которой считываются функцией в момент запроса.
+
+    Подходит для глубины очередей и статистики кэшей: значения не нужно
+    обновлять вручную — они берутся у объекта при каждом запросе метрик.
+    func возвращает число либо словарь {значения меток: число}.
+    """
+
+    def __init__(self, name, documentation, func, labels=(), kind="gauge"):
+        """Задаёт имя, описание, функцию чтения, имена меток и тип метрики."""
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def samples(self):
+        """Возвращает строки метрики в текстовом формате."""
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {value}"
+            for key, value in values.items()
+        ]
+
+
+class Registry:
+    """Набор метрик, отдаваемых HTTP-эндпоинтом."""
+
+    def __init__(self):
+        """Создаёт пустой реестр."""
+        self.slow_threshold = 0  # сек; 0 — медленные вызовы не логируются
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Добавляет метрику; метрика с тем же именем заменяется."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        """Создаёт и регистрирует счётчик."""
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """Создаёт и регистрирует гистограмму."""
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def collect(self, name, documentation, func, labels=(), kind="gauge"):
+        """Регистрирует метрику, вычисляемую функцией func при каждом запросе."""
+        return self.register(Collector(name, documentation, func, labels, kind))
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logging.warning(f"Не удалось собрать метрику {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "Время обработки сообщения по шагам диалога", ["step"]
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Ошибки обработки сообщений по шагам диалога", ["step"]
+)
+VK_CALL_SECONDS = REGISTRY.histogram(
+    "vk_call_seconds",
+    "Время вызова метода VK с учётом ожидания лимита и объединения в execute",
+    ["method"],
+)
+VK_REQUEST_SECONDS = REGISTRY.histogram(
+    "vk_request_seconds", "Время HTTP-запроса к VK API", ["method"]
+)
+VK_ERRORS = REGISTRY.counter(
+    "vk_errors_total", "Ошибки VK API по методам и кодам", ["method", "code"]
+)
+VK_COALESCED = REGISTRY.counter(
+    "vk_coalesced_total",
+    "Вызовы VK, присоединённые к такому же уже выполняющемуся вызову",
+    ["method"],
+)
+OUTBOX_SECONDS = REGISTRY.histogram(
+    "outbox_delivery_seconds", "Время доставки пачки исходящих сообщений"
+)
+DB_SECONDS = REGISTRY.histogram(
+    "db_query_seconds", "Время выполнения методов DatabaseManager", ["method"]
+)
+DB_ERRORS = REGISTRY.counter(
+    "db_errors_total", "Ошибки методов DatabaseManager", ["method"]
+)
+PREWARM_CALLS = REGISTRY.counter(
+    "prewarm_calls_total", "Вызовы VK фонового прогрева кэша", ["kind"]
+)
+RESTARTS = REGISTRY.counter(
+    "restarts_total", "Перезапуски компонентов после ошибок", ["component"]
+)
+
+
+def set_slow_threshold(seconds):
+    """Включает логирование аргументов вызовов дольше seconds (0 — выключить)."""
+    REGISTRY.slow_threshold = seconds
+
+
+@contextmanager
+def track(histogram, label, errors=None, args=None):
+    """Замеряет длительность блока и записывает её в гистограмму с меткой label.
+
+    Исключения учитываются в счётчике errors. Если блок выполнялся дольше
+    порога медленных вызовов, в лог попадают его аргументы args.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.inc(label)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, label)
+        threshold = REGISTRY.slow_threshold
+        if threshold and elapsed >= threshold:
+            logging.warning(
+                f"Медленный вызов {histogram.name}[{label}]: {elapsed:.3f} с, "
+                f"аргументы: {_repr.repr(args)}"
+            )
+
+
+def timed(histogram, errors=None):
+    """Декоратор метода: замеряет каждый вызов с меткой по имени метода."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with track(histogram, func.__name__, errors, (args, kwargs)):
+                return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Отдаёт метрики по GET /metrics."""
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Не засоряет лог запросами сборщика метрик."""
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """Запускает HTTP-эндпоинт метрик в фоновом потоке и возвращает сервер."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics-http", daemon=True
+    )
+    thread.start()
+    return server
@@ -0,0 +1,149 @@
+import asyncio
+import functools
+import logging
+import random
+import time
+from collections import deque
+
+from vk_api.utils import get_random_id
+
+from metrics import OUTBOX_SECONDS, VK_ERRORS
+from vk_async import VkRequestError, execute_code, prepare_params
+
+# Ошибки VK, после которых отправку имеет смысл повторить:
+# 6 — слишком много запросов, 9 — flood control, 10 — внутренняя ошибка сервера
+RETRY_CODES = {6, 9, 10}
+
+
+class AsyncOutbox:
+    """Очередь исходящих сообщений с порядком доставки для каждого получателя.
+
+    У каждого получателя своя очередь; накопившиеся сообщения одного
+    получателя отправляются одним execute (VK выполняет их по порядку).
+    Сбойные отправки повторяются с тем же random_id, поэтому VK не
+    продублирует уже доставленные сообщения.
+    """
+
+    MAX_MERGE = 25
+
+    def __init__(self, client, merge=True, retries=3, retry_delay=1.0):
+        """client — клиент с токеном группы (VkScheduler или BatchingClient)."""
+        self.client = client
+        self.merge = merge
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.sent = 0
+        self.failed = 0
+        self._queues = {}  # user_id -> deque параметров messages.send
+        self._workers = {}  # user_id -> задача, разбирающая очередь
+
+    def send(self, user_id, message, attachment=None, keyboard=None):
+        """Ставит сообщение в очередь получателя (вызывать в цикле событий)."""
+        params = prepare_params(
+            {
+                "user_id": user_id,
+                "random_id": get_random_id(),
+                "message": message,
+                "attachment": attachment,
+                "keyboard": keyboard,
+            }
+        )
+        self._queues.setdefault(user_id, deque()).append(params)
+        if user_id not in self._workers:
+            self._workers[user_id] = asyncio.ensure_future(self._worker(user_id))
+
+    def pending(self):
+        """Возвращает число сообщений, ещё не переданных в VK."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def _worker(self, user_id):
+        """Отправляет сообщения одного получателя строго по очереди."""
+        queue = self._queues[user_id]
+        try:
+            while queue:
+                size = min(self.MAX_MERGE if self.merge else 1, len(queue))
+                start = time.perf_counter()
+                await self._deliver([queue.popleft() for _ in range(size)])
+                OUTBOX_SECONDS.observe(time.perf_counter() - start)
+        finally:
+            del self._workers[user_id]
+            del self._queues[user_id]
+
+    async def _deliver(self, chunk):
+        """Отправляет пачку сообщений, повторяя её при временных сбоях."""
+        for attempt in range(self.retries + 1):
+            try:
+                chunk = await self._send_chunk(chunk)
+            except VkRequestError as e:
+                if e.code not in RETRY_CODES:
+                    logging.error(f"Сообщение не отправлено: {e}")
+                    self.failed += len(chunk)
+                    return
+            except Exception as e:
+                logging.warning(f"Сбой отправки сообщения: {e}")
+            if not chunk:
+                return
+            if attempt < self.retries:
+                delay = self.retry_delay * 2**attempt
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        logging.error(f"Не удалось отправить сообщений: {len(chunk)}")
+        self.failed += len(chunk)
+
+    async def _send_chunk(self, chunk):
+        """Отправляет сообщения и возвращает те, которые нужно повторить."""
+        if len(chunk) == 1:
+            await self.client.call("messages.send", **chunk[0])
+            self.sent += 1
+            return []
+
+        code = execute_code(("messages.send", params) for params in chunk)
+        data = await self.client.request("execute", code=code)
+        errors = iter(data.get("execute_errors", []))
+        retry = []
+        missing = len(chunk) - len(data["response"])
+        if missing > 0:
+            # Неизвестно, ушли ли они: не повторяем, чтобы не отправить дважды
+            logging.error(f"Нет результата отправки в ответе execute: {missing}")
+            self.failed += missing
+        for result, params in zip(data["response"], chunk):
+            if result is not False:
+                self.sent += 1
+                continue
+            error = next(errors, {})
+            VK_ERRORS.inc("messages.send", error.get("error_code"))
+            if error.get("error_code") in RETRY_CODES:
+                retry.append(params)
+            else:
+                logging.error(f"Сообщение не отправлено: {error.get('error_msg')}")
+                self.failed += 1
+        return retry
+
+    async def drain(self):
+        """Дожидается отправки всех сообщений из очереди."""
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+
+class Outbox:
+    """Синхронный интерфейс к AsyncOutbox: send() возвращается сразу."""
+
+    def __init__(self, outbox, loop):
+        """Связывает очередь с фоновым циклом событий (EventLoopThread)."""
+        self.outbox = outbox
+        self.loop = loop
+
+    def send(self, user_id, message, attachment=None, keyboard=None):
+        """Ставит сообщение в очередь, не дожидаясь сетевого запроса."""
+        self.loop.loop.call_soon_threadsafe(
+            functools.partial(
+                self.outbox.send, user_id, message, attachment, keyboard
+            )
+        )
+
+    def pending(self):
+        """Возвращает число сообщений в очереди."""
+        return self.outbox.pending()
+
+    def drain(self, timeout=None):
+        """Блокирует поток, пока очередь не опустеет."""
+        self.loop.run(self.outbox.drain(), timeout)
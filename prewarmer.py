@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+import logging
+
+from metrics import PREWARM_CALLS
+from vk_async import BACKGROUND
+
+IDLE_CHECK_DELAY = 0.2  # сек между проверками, свободны ли токены
+
+
+def parse_hours(value):
+    """Разбирает окно часов вида "1-7" (или "22-6") в пару (начало, конец)."""
+    if not value:
+        return None
+    start, _, end = value.partition("-")
+    return int(start), int(end or start) + (0 if end else 1)
+
+
+class Prewarmer:
+    """Фоновый прогрев кэша поиска для самых популярных критериев.
+
+    Раз в interval секунд берёт top самых частых критериев из сохранённых
+    состояний диалогов, загружает для каждого pages страниц поиска и фото
+    первых photos кандидатов каждой страницы. Запросы идут с приоритетом
+    BACKGROUND и только когда у токенов нет ожидающих интерактивных вызовов;
+    за один проход тратится не больше budget вызовов VK. Если задано окно
+    hours, прогрев идёт только в эти часы (например, ночью).
+    """
+
+    def __init__(
+        self,
+        searcher,
+        load_searches,
+        store=None,
+        top=20,
+        pages=1,
+        photos=10,
+        budget=300,
+        interval=600,
+        ttl=3600,
+        hours=None,
+    ):
+        """Принимает AsyncVkSearcher и функцию load_searches(limit) -> [критерии].
+
+        store — объект с методом save_candidates (обычно DatabaseManager):
+        кандидаты сохраняются в БД, чтобы туда же записались их фото.
+        ttl — сколько секунд прогретая страница поиска считается свежей.
+        """
+        self.searcher = searcher
+        self.load_searches = load_searches
+        self.store = store
+        self.top = top
+        self.pages = pages
+        self.photos = photos
+        self.budget = budget
+        self.interval = interval
+        self.ttl = ttl
+        self.hours = parse_hours(hours) if isinstance(hours, str) else hours
+
+    def _in_hours(self):
+        """Проверяет, что сейчас разрешённое для прогрева время."""
+        if not self.hours:
+            return True
+        start, end = self.hours
+        hour = datetime.datetime.now().hour
+        if start < end:
+            return start <= hour < end
+        return hour >= start or hour < end  # окно через полночь
+
+    async def _wait_idle(self):
+        """Ждёт, пока у токенов не останется ожидающих вызовов."""
+        while self.searcher.client.queue_size():
+            await asyncio.sleep(IDLE_CHECK_DELAY)
+
+    async def run_once(self):
+        """Прогревает кэш один раз; возвращает число сделанных вызовов VK."""
+        if not self._in_hours():
+            return 0
+        searches = await asyncio.to_thread(self.load_searches, self.top)
+        spent = 0
+        for search in searches:
+            offset = 0
+            for _ in range(self.pages):
+                if spent >= self.budget:
+                    return spent
+                key = (
+                    search["age_from"],
+                    search["age_to"],
+                    search["sex"],
+                    search["city_id"],
+                    offset,
+                )
+                fresh = key in self.searcher.searches
+                await self._wait_idle()
+                page = await self.searcher.search_page(
+                    *key, priority=BACKGROUND, ttl=self.ttl
+                )
+                if not fresh:
+                    spent += 1
+                    PREWARM_CALLS.inc("search")
+                    if self.store and page["items"]:
+                        await asyncio.to_thread(
+                            self.store.save_candidates, page["items"]
+                        )
+                if page.get("error"):
+                    break
+
+                ids = [
+                    person["id"]
+                    for person in page["items"][: self.photos]
+                    if person["id"] not in self.searcher.photos
+                ][: self.budget - spent]
+                if ids:
+                    await self._wait_idle()
+                    await self.searcher.prefetch_photos(ids)
+                    spent += len(ids)
+                    PREWARM_CALLS.inc("photos", amount=len(ids))
+
+                offset = page["next_offset"]
+                if offset is None:
+                    break
+        return spent
+
+    async def run(self):
+        """Прогревает кэш каждые interval секунд, пока задачу не отменят."""
+        while True:
+            try:
+                spent = await self.run_once()
+                if spent:
+                    logging.info(f"Прогрев кэша поиска: вызовов VK: {spent}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка прогрева кэша поиска: {e}")
+            await asyncio.sleep(self.interval)
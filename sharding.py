@@ -0,0 +1,202 @@
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+from dispatcher import EventDispatcher
+
+HEARTBEAT_INTERVAL = 1.0  # сек между отметками «жив» от процесса-шарда
+
+_STOP = None
+
+
+def _shard_main(factory, shard, conn, heartbeat, workers, queue_size):
+    """Цикл процесса-шарда: принимает сообщения и раздаёт их своим потокам."""
+    # Ctrl+C обрабатывает родитель и останавливает шарды через канал
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    handler, close = factory(shard)
+    dispatcher = EventDispatcher(handler, workers=workers, queue_size=queue_size)
+    try:
+        while True:
+            heartbeat.value = time.time()
+            if not conn.poll(HEARTBEAT_INTERVAL):
+                continue
+            try:
+                item = conn.recv()
+            except EOFError:  # родитель закрыл канал
+                break
+            if item is _STOP:
+                break
+            # Пока очередь потока заполнена, шард занят, а не завис:
+            # продолжаем отмечаться, чтобы родитель его не перезапустил
+            while not dispatcher.try_submit(*item, timeout=HEARTBEAT_INTERVAL):
+                heartbeat.value = time.time()
+    finally:
+        dispatcher.shutdown()
+        close()
+
+
+class ShardedDispatcher:
+    """Раздаёт сообщения процессам-шардам по user_id — аналог EventDispatcher.
+
+    Пользователь всегда попадает в один и тот же шард (user_id % shards),
+    а внутри шарда — в один поток, поэтому его сообщения обрабатываются
+    по порядку. У каждого шарда свой бот, поисковик и подключение к БД:
+    их создаёт factory(shard) -> (handler, close) уже в дочернем процессе.
+
+    Сообщения копятся в очереди родителя и передаются шарду через pipe.
+    Упавший шард перезапускается, как и зависший: процесс, который дольше
+    health_timeout не отмечается в heartbeat, считается зависшим. Шард,
+    ожидающий места в очереди медленного потока, продолжает отмечаться
+    и не перезапускается. Сообщения из очереди родителя при перезапуске
+    сохраняются, теряются только уже переданные погибшему процессу.
+    """
+
+    def __init__(
+        self,
+        factory,
+        shards=2,
+        workers=8,
+        queue_size=100,
+        put_timeout=None,
+        health_timeout=60,
+    ):
+        """Запускает процессы-шарды и поток проверки их состояния.
+
+        factory должна быть функцией уровня модуля (передаётся в дочерний
+        процесс); workers и queue_size — параметры EventDispatcher в шарде.
+        """
+        self.factory = factory
+        self.workers = workers
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self.health_timeout = health_timeout
+        self.restarts = 0
+        # spawn: в родителе уже работают потоки, fork их бы не скопировал
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(shards)]
+        self.heartbeats = [self._context.Value("d", time.time()) for _ in range(shards)]
+        self.connections = [None] * shards
+        self.processes = [self._start(shard) for shard in range(shards)]
+        self._closed = False
+        self._stop = threading.Event()
+        self._feeders = []
+        for shard in range(shards):
+            thread = threading.Thread(
+                target=self._feed,
+                args=(shard,),
+                name=f"shard-feeder-{shard}",
+                daemon=True,
+            )
+            thread.start()
+            self._feeders.append(thread)
+        self._monitor = threading.Thread(
+            target=self._watch, name="shard-monitor", daemon=True
+        )
+        self._monitor.start()
+
+    def _start(self, shard):
+        """Запускает процесс шарда с новым каналом."""
+        reader, writer = self._context.Pipe(duplex=False)
+        self.heartbeats[shard].value = time.time()
+        process = self._context.Process(
+            target=_shard_main,
+            args=(
+                self.factory,
+                shard,
+                reader,
+                self.heartbeats[shard],
+                self.workers,
+                self.queue_size,
+            ),
+            name=f"shard-{shard}",
+            daemon=True,
+        )
+        process.start()
+        # Конец для чтения остаётся только у шарда: если он погибнет,
+        # запись в канал сразу завершится ошибкой
+        reader.close()
+        self.connections[shard] = writer
+        return process
+
+    def _feed(self, shard):
+        """Передаёт сообщения из очереди шарда в его процесс."""
+        item = self.queues[shard].get()
+        while True:
+            try:
+                self.connections[shard].send(item)
+            except (OSError, ValueError):
+                # Шард погиб; ждём, пока монитор запустит новый
+                if self._stop.wait(HEARTBEAT_INTERVAL):
+                    return
+                continue
+            if item is _STOP:
+                return
+            item = self.queues[shard].get()
+
+    def _watch(self):
+        """Перезапускает упавшие и переставшие отвечать шарды."""
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            for shard, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logging.error(
+                        f"Шард {shard} завершился с кодом {process.exitcode}, "
+                        "перезапускаем"
+                    )
+                elif time.time() - self.heartbeats[shard].value > self.health_timeout:
+                    logging.error(f"Шард {shard} не отвечает, перезапускаем")
+                    process.terminate()
+                    process.join(5)
+                    if process.is_alive():
+                        process.kill()
+                        process.join()
+                else:
+                    continue
+                if self._stop.is_set():
+                    return
+                self.connections[shard].close()
+                self.restarts += 1
+                self.processes[shard] = self._start(shard)
+
+    def _queue_for(self, user_id):
+        """Возвращает очередь шарда, за которым закреплён пользователь."""
+        return self.queues[user_id % len(self.queues)]
+
+    def submit(self, user_id, text):
+        """Передаёт сообщение шарду пользователя.
+
+        Поведение при переполнении такое же, как у EventDispatcher.submit.
+        """
+        if self._closed:
+            raise RuntimeError("Диспетчер остановлен")
+        try:
+            self._queue_for(user_id).put((user_id, text), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            logging.warning(f"Очередь переполнена, сообщение {user_id} отброшено")
+            return False
+
+    def queue_sizes(self):
+        """Возвращает число сообщений, ещё не переданных каждому шарду."""
+        return [q.qsize() for q in self.queues]
+
+    def shutdown(self, timeout=None):
+        """Дожидается обработки принятых сообщений и останавливает шарды."""
+        if self._closed:
+            return
+        self._closed = True
+        for q in self.queues:
+            q.put(_STOP)
+        for thread in self._feeders:
+            thread.join(timeout)
+        self._stop.set()
+        self._monitor.join()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logging.warning(f"Шард {process.name} не остановился, завершаем")
+                process.terminate()
+        for conn in self.connections:
+            conn.close()
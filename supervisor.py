@@ -0,0 +1,54 @@
+import logging
+import random
+import time
+
+from metrics import RESTARTS
+from vk_async import VkRequestError
+
+
+class Backoff:
+    """Экспоненциально растущая задержка со случайным разбросом."""
+
+    def __init__(self, base=1.0, maximum=60.0):
+        """Задаёт первую и наибольшую задержку в секундах."""
+        self.base = base
+        self.maximum = maximum
+        self.attempt = 0
+
+    def next(self):
+        """Возвращает задержку перед очередной попыткой."""
+        delay = min(self.maximum, self.base * 2**self.attempt)
+        self.attempt += 1
+        return delay * random.uniform(0.5, 1.5)
+
+    def reset(self):
+        """Начинает отсчёт задержек заново."""
+        self.attempt = 0
+
+
+def supervise(target, name, on_error=None, base_delay=1.0, max_delay=60.0):
+    """Выполняет target() и перезапускает его после ошибок.
+
+    Между попытками — экспоненциальная задержка с разбросом; если target
+    успел проработать дольше max_delay, задержки начинаются заново.
+    on_error() вызывается перед перезапуском, чтобы переподключить только
+    сломавшийся компонент. Возвращает результат target, когда тот
+    завершится без ошибки.
+    """
+    backoff = Backoff(base_delay, max_delay)
+    while True:
+        started = time.monotonic()
+        try:
+            return target()
+        except VkRequestError as e:
+            logging.error(f"{name}: ошибка API ВКонтакте: {e}")
+        except Exception as e:
+            logging.error(f"{name}: неожиданная ошибка: {e}")
+        RESTARTS.inc(name)
+        if time.monotonic() - started > max_delay:
+            backoff.reset()
+        delay = backoff.next()
+        logging.info(f"{name}: перезапуск через {delay:.1f} с")
+        time.sleep(delay)
+        if on_error:
+            on_error()
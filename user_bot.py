@@ -1,26 +1,29 @@
-from vk_api.utils import get_random_id
-
-from keyboard import get_action_buttons, get_sex_keyboard
+from keyboard import (get_action_buttons, get_favorites_keyboard,
+                      get_sex_keyboard)
+from metrics import HANDLER_ERRORS, HANDLER_SECONDS, track
 
 
 class UserBot:
     """Управляет диалогом с пользователем через VK API."""
 
-    def __init__(self, vk_api, searcher, db):
-        """Инициализирует бота с API, поисковиком и БД."""
-        self.vk = vk_api
+    # VK прикрепляет к сообщению не больше 10 вложений
+    MAX_FAVORITES_PAGE = 10
+
+    def __init__(self, outbox, searcher, db, prefetch=5, favorites_page_size=10):
+        """Инициализирует бота с очередью отправки, поисковиком и БД.
+
+        prefetch — сколько следующих кандидатов загружать заранее,
+        favorites_page_size — сколько избранных показывать в одном сообщении.
+        """
+        self.outbox = outbox
         self.searcher = searcher
         self.db = db
+        self.prefetch = prefetch
+        self.favorites_page_size = min(favorites_page_size, self.MAX_FAVORITES_PAGE)
 
     def send_message(self, user_id, message, attachment=None, keyboard=None):
-        """Отправляет сообщение пользователю."""
-        self.vk.messages.send(
-            user_id=user_id,
-            random_id=get_random_id(),
-            message=message,
-            attachment=attachment,
-            keyboard=keyboard,
-        )
+        """Ставит сообщение пользователю в очередь отправки."""
+        self.outbox.send(user_id, message, attachment=attachment, keyboard=keyboard)
 
     def handle_message(self, user_id, text):
         """Обрабатывает входящее сообщение от пользователя."""
@@ -28,10 +31,13 @@ class UserBot:
 
         # Всегда обрабатываем /start
         if text == "/start" or text == "новый поиск":
-            # Создаём пользователя и обнуляем состояние
-            self.db.get_or_create_user(vk_id=user_id)
-            self.db.save_user_state(user_id, {"step": "wait_age"})
-            self.send_message(user_id, "Привет! Введи желаемый возраст (например: 25).")
+            with track(HANDLER_SECONDS, "start", HANDLER_ERRORS, (user_id, text)):
+                # Создаём пользователя и обнуляем состояние
+                self.db.get_or_create_user(vk_id=user_id)
+                self.db.save_user_state(user_id, {"step": "wait_age"})
+                self.send_message(
+                    user_id, "Привет! Введи желаемый возраст (например: 25)."
+                )
             return
 
         # Загружаем состояние из БД
@@ -41,7 +47,11 @@ class UserBot:
             return
 
         step = state["step"]
+        with track(HANDLER_SECONDS, step, HANDLER_ERRORS, (user_id, text)):
+            self._handle_step(user_id, text, step, state)
 
+    def _handle_step(self, user_id, text, step, state):
+        """Обрабатывает сообщение на текущем шаге диалога."""
         if step == "wait_age":
             if text.isdigit() and 14 <= int(text) <= 90:
                 state["age"] = int(text)
@@ -83,27 +93,32 @@ class UserBot:
                 self.send_message(user_id, "Город не найден. Попробуйте ещё раз.")
             else:
                 age = state["age"]
-                age_from, age_to = max(14, age - 1), age + 1
-                sex = state["sex"]
-
-                candidates = self.searcher.search_users(age_from, age_to, sex, city_id)
-
-                if not candidates:
+                state["search"] = {
+                    "age_from": max(14, age - 1),
+                    "age_to": age + 1,
+                    "sex": state["sex"],
+                    "city_id": city_id,
+                }
+                state["next_offset"] = 0
+                state["queue_size"] = 0
+
+                found, added, failed = self._load_more(user_id, state)
+
+                if failed:
+                    self.send_message(
+                        user_id, "Не удалось выполнить поиск. Попробуйте ещё раз."
+                    )
+                elif not found:
                     self.send_message(user_id, "Кандидаты не найдены.")
+                elif not added:
+                    self.send_message(user_id, "Нет новых кандидатов.")
                 else:
-                    # Фильтруем: убираем тех, кто уже в избранном
-                    favorites = self.db.get_favorites(user_vk_id=user_id)
-                    favorite_ids = {fav["vk_id"] for fav in favorites}
-                    filtered = [c for c in candidates if c["id"] not in favorite_ids]
-
-                    if not filtered:
-                        self.send_message(user_id, "Нет новых кандидатов.")
-                    else:
-                        state["step"] = "showing"
-                        state["candidates"] = filtered
-                        state["index"] = 0
-                        self.db.save_user_state(user_id, state)
-                        self.send_next_candidate(user_id)
+                    # Кандидаты хранятся в отдельной очереди, в состоянии
+                    # остаётся только номер текущего и позиция в поиске
+                    state["step"] = "showing"
+                    state["index"] = 0
+                    self.db.save_user_state(user_id, state)
+                    self.send_next_candidate(user_id)
 
         elif step == "showing":
             if text == "дальше":
@@ -112,20 +127,73 @@ class UserBot:
                 self.add_to_favorites(user_id)
             elif text == "избранное":
                 self.show_favorites(user_id)
+            elif text == "следующие":
+                self.show_favorites(user_id, "next")
+            elif text == "предыдущие":
+                self.show_favorites(user_id, "prev")
+
+    def _load_more(self, user_id, state):
+        """Дописывает в очередь следующие страницы поиска, пока не найдутся новые.
+
+        Возвращает (сколько найдено в VK, сколько добавлено в очередь,
+        не удалось ли загрузить страницу). При ошибке позиция в поиске
+        не меняется, и следующий вызов повторит запрос той же страницы.
+        """
+        found = added = 0
+        seen = None
+        while not added and state.get("next_offset") is not None:
+            page = self.searcher.search_page(
+                offset=state["next_offset"], **state["search"]
+            )
+            if page.get("error"):
+                return found, added, True
+            state["next_offset"] = page["next_offset"]
+            if not page["items"]:
+                continue
+            found += len(page["items"])
+
+            if seen is None:
+                # Фильтруем: убираем тех, кого пользователь уже видел
+                # (избранное входит сюда же)
+                seen = self.db.get_seen(user_id)
+            candidates = [c for c in page["items"] if c["id"] not in seen]
+
+            if candidates:
+                self.db.save_candidates(candidates)
+                self.db.extend_queue(user_id, candidates, state["queue_size"])
+                state["queue_size"] += len(candidates)
+                added = len(candidates)
+        return found, added, False
 
     def send_next_candidate(self, user_id):
         """Показывает следующего кандидата из списка."""
         state = self.db.load_user_state(user_id)
-        if not state or "candidates" not in state:
+        if not state or "index" not in state:
             self.send_message(
                 user_id, "Ошибка. Начните с /start.", keyboard=get_action_buttons()
             )
             return
 
-        idx = state["index"]
-        candidates = state["candidates"]
+        # Очередь подходит к концу — догружаем следующую страницу поиска
+        failed = False
+        if (
+            state.get("next_offset") is not None
+            and state["index"] + self.prefetch >= state["queue_size"]
+        ):
+            _, _, failed = self._load_more(user_id, state)
+            self.db.save_user_state(user_id, state)
+
+        # Текущий кандидат и несколько следующих одним запросом
+        upcoming = self.db.get_queue_items(user_id, state["index"], self.prefetch + 1)
 
-        if idx >= len(candidates):
+        if not upcoming and failed:
+            self.send_message(
+                user_id,
+                "Не удалось загрузить кандидатов. Нажмите «Дальше» ещё раз.",
+                keyboard=get_action_buttons(),
+            )
+            return
+        if not upcoming:
             self.send_message(
                 user_id,
                 "Кандидаты закончились. Начните новый поиск.",
@@ -133,7 +201,11 @@ class UserBot:
             )
             return
 
-        person = candidates[idx]
+        person = upcoming[0]
+        if len(upcoming) > 1:
+            # Пока пользователь смотрит текущего, фото следующих грузятся в кэш
+            self.searcher.prefetch_photos(p["id"] for p in upcoming[1:])
+
         name = f"{person['first_name']} {person['last_name']}"
         link = f"vk.com/id{person['id']}"
         message = f"Имя: {name}\nСсылка: {link}"
@@ -148,28 +220,22 @@ class UserBot:
             keyboard=get_action_buttons(),
         )
 
-        # Сохраняем кандидата в БД
-        self.db.get_or_create_candidate(
-            vk_id=person["id"],
-            first_name=person["first_name"],
-            last_name=person["last_name"],
-            profile_url=link,
-            photos=photos,
-        )
-
-        # Обновляем индекс
+        # Обновляем индекс и запоминаем, что кандидат показан
         state["index"] += 1
         self.db.save_user_state(user_id, state)
+        self.db.mark_seen(user_id, person["id"])
 
     def add_to_favorites(self, user_id):
         """Добавляет текущего кандидата в избранное."""
         state = self.db.load_user_state(user_id)
-        if not state or "candidates" not in state or state["index"] == 0:
+        if not state or not state.get("index"):
             self.send_message(user_id, "Сначала посмотрите кандидата.")
             return
 
-        current_idx = state["index"] - 1
-        person = state["candidates"][current_idx]
+        person = self.db.get_queue_item(user_id, state["index"] - 1)
+        if not person:
+            self.send_message(user_id, "Сначала посмотрите кандидата.")
+            return
         photos = self.searcher.get_top_photos(person["id"])
 
         success = self.db.add_to_favorites(
@@ -186,21 +252,59 @@ class UserBot:
         else:
             self.send_message(user_id, "Этот кандидат уже в избранном.")
 
-    def show_favorites(self, user_id):
-        """Отправляет пользователю всех кандидатов из избранного."""
-        favorites = self.db.get_favorites(user_vk_id=user_id)
+    def show_favorites(self, user_id, direction=None):
+        """Показывает страницу избранного одним сообщением.
+
+        direction — "next" или "prev" относительно последней показанной
+        страницы; без него показывается первая страница.
+        """
+        state = self.db.load_user_state(user_id) or {}
+        page = state.get("favorites_page") if direction else None
+        size = self.favorites_page_size
+
+        # Запрашиваем на одну запись больше, чтобы узнать, есть ли ещё страница
+        if page and direction == "prev":
+            favorites = self.db.get_favorites(
+                user_vk_id=user_id, limit=size + 1, before=page["first"]
+            )
+            has_prev = len(favorites) > size
+            favorites = favorites[-size:]
+            has_next = True
+            number = max(1, page["number"] - 1)
+        else:
+            after = page["last"] if page else None
+            favorites = self.db.get_favorites(
+                user_vk_id=user_id, limit=size + 1, after=after
+            )
+            has_next = len(favorites) > size
+            favorites = favorites[:size]
+            has_prev = after is not None
+            number = page["number"] + 1 if page else 1
+
         if not favorites:
-            self.send_message(user_id, "Ваш список избранного пуст.")
+            self.send_message(
+                user_id, "Ваш список избранного пуст.", keyboard=get_action_buttons()
+            )
             return
 
-        for fav in favorites:
+        lines = [f"Избранное, страница {number}:"]
+        photos = []
+        for position, fav in enumerate(favorites, (number - 1) * size + 1):
             name = f"{fav['first_name']} {fav['last_name']}"
-            link = fav["profile_url"]
-            message = f"{name}\nСсылка: {link}"
-            attachment = ",".join(fav["photos"]) if fav["photos"] else None
-
-            self.send_message(user_id, message, attachment=attachment)
+            lines.append(f"{position}. {name} — {fav['profile_url']}")
+            if fav["photos"]:
+                photos.append(fav["photos"][0])  # Лучшее фото каждого кандидата
 
         self.send_message(
-            user_id, "Это всё из вашего избранного.", keyboard=get_action_buttons()
+            user_id,
+            "\n".join(lines),
+            attachment=",".join(photos) if photos else None,
+            keyboard=get_favorites_keyboard(has_prev, has_next),
         )
+
+        state["favorites_page"] = {
+            "first": favorites[0]["cursor"],
+            "last": favorites[-1]["cursor"],
+            "number": number,
+        }
+        self.db.save_user_state(user_id, state)
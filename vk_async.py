@@ -0,0 +1,624 @@
+import asyncio
+import json
+import logging
+import threading
+
+import aiohttp
+from vk_api.utils import get_random_id
+
+from cache import TTLCache
+from city_index import CityIndex
+from metrics import (VK_CALL_SECONDS, VK_COALESCED, VK_ERRORS, VK_REQUEST_SECONDS,
+                     track)
+
+API_URL = "https://api.vk.com/method/"
+API_VERSION = "5.199"
+SEARCH_PAGE_SIZE = 100
+SEARCH_MAX_RESULTS = 1000  # users.search не отдаёт результаты дальше тысячного
+
+PHOTO_FLUSH_DELAY = 1.0  # сек, за которые копятся фото для записи в БД
+
+# Приоритеты вызовов: ответы пользователю важнее фоновой предзагрузки
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class Priority:
+    """Приоритет вызова, который можно повысить, пока вызов ждёт очереди.
+
+    Вызовы принимают как число (INTERACTIVE, BACKGROUND), так и Priority.
+    Если к фоновому вызову присоединяется интерактивный, общему вызову
+    повышают приоритет, и он обгоняет остальные фоновые.
+    """
+
+    def __init__(self, value=INTERACTIVE):
+        """Задаёт начальный приоритет (меньшее число — срочнее)."""
+        self.value = value
+        self._callbacks = []
+
+    def raise_to(self, value):
+        """Повышает приоритет до value и сообщает об этом подписчикам."""
+        if value < self.value:
+            self.value = value
+            for callback in list(self._callbacks):
+                callback()
+
+    def subscribe(self, callback):
+        """Вызывает callback() при каждом повышении приоритета."""
+        self._callbacks.append(callback)
+
+
+def priority_value(priority):
+    """Возвращает числовое значение приоритета (числа или Priority)."""
+    return priority.value if isinstance(priority, Priority) else priority
+
+
+def follow_priority(target, source):
+    """Повышает Priority target до source сейчас и при каждом повышении source."""
+    target.raise_to(priority_value(source))
+    if isinstance(source, Priority):
+        source.subscribe(lambda: target.raise_to(source.value))
+
+
+class VkRequestError(Exception):
+    """Ошибка, которую вернул VK API."""
+
+    def __init__(self, method, code, message):
+        """Сохраняет метод и код ошибки VK."""
+        super().__init__(f"[{code}] {method}: {message}")
+        self.method = method
+        self.code = code
+
+
+def prepare_params(params):
+    """Приводит параметры к виду, который принимает VK API."""
+    prepared = {}
+    for key, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = int(value)
+        elif isinstance(value, (list, tuple, set)):
+            value = ",".join(str(v) for v in value)
+        prepared[key] = value
+    return prepared
+
+
+def execute_code(calls):
+    """Собирает код VKScript, выполняющий вызовы (method, params) по порядку."""
+    return "return [%s];" % ",".join(
+        f"API.{method}({json.dumps(prepare_params(params), ensure_ascii=False)})"
+        for method, params in calls
+    )
+
+
+class AsyncVkClient:
+    """Асинхронный клиент VK API с пулом keep-alive соединений."""
+
+    def __init__(self, token, api_url=API_URL, version=API_VERSION, pool_size=100):
+        """Запоминает токен; HTTP-сессия создаётся при первом запросе."""
+        self.token = token
+        self.api_url = api_url
+        self.version = version
+        self.pool_size = pool_size
+        self._session = None
+
+    def get_session(self):
+        """Возвращает общую HTTP-сессию, создавая её внутри цикла событий."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size, keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self._session
+
+    async def request(self, method, priority=INTERACTIVE, **params):
+        """Вызывает метод VK API и возвращает ответ целиком.
+
+        priority учитывается планировщиком (VkScheduler), здесь не используется.
+        """
+        params = prepare_params(params)
+        params.setdefault("v", self.version)
+        data = dict(params, access_token=self.token)
+        with track(VK_REQUEST_SECONDS, method, args=params):
+            try:
+                async with self.get_session().post(
+                    self.api_url + method, data=data
+                ) as resp:
+                    data = await resp.json(content_type=None)
+            except Exception:
+                VK_ERRORS.inc(method, "http")
+                raise
+        if "error" in data:
+            error = data["error"]
+            VK_ERRORS.inc(method, error.get("error_code"))
+            raise VkRequestError(
+                method, error.get("error_code"), error.get("error_msg")
+            )
+        return data
+
+    async def call(self, method, priority=INTERACTIVE, **params):
+        """Вызывает метод VK API и возвращает поле response."""
+        return (await self.request(method, priority, **params))["response"]
+
+    async def send_message(self, user_id, message, attachment=None, keyboard=None):
+        """Отправляет сообщение пользователю от имени сообщества."""
+        return await self.call(
+            "messages.send",
+            user_id=user_id,
+            random_id=get_random_id(),
+            message=message,
+            attachment=attachment,
+            keyboard=keyboard,
+        )
+
+    async def close(self):
+        """Закрывает HTTP-сессию."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class BatchingClient:
+    """Объединяет вызовы, пришедшие в течение короткого окна, в один execute.
+
+    За один запрос execute VK выполняет до 25 методов; результат или ошибка
+    каждого вызова возвращается тому, кто его сделал.
+    """
+
+    MAX_BATCH = 25
+
+    def __init__(self, client, window=0.01):
+        """Оборачивает AsyncVkClient; window — время ожидания попутчиков (сек)."""
+        self.client = client
+        self.window = window
+        self._pending = []  # (method, params, priority, future)
+        self._timer = None
+        self._tasks = set()
+
+    def __getattr__(self, name):
+        """Остальные методы (get_session, close и т.д.) берутся у клиента."""
+        return getattr(self.client, name)
+
+    async def call(self, method, priority=INTERACTIVE, **params):
+        """Ставит вызов в текущую пачку и ждёт его результата."""
+        with track(VK_CALL_SECONDS, method, args=params):
+            if self.window <= 0:
+                return await self.client.call(method, priority, **params)
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending.append((method, params, priority, future))
+            if len(self._pending) >= self.MAX_BATCH:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+            return await future
+
+    def _flush(self):
+        """Отправляет накопленные вызовы пачками по MAX_BATCH."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[: self.MAX_BATCH]
+            self._pending = self._pending[self.MAX_BATCH:]
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch):
+        """Выполняет пачку вызовов и раздаёт результаты."""
+        if len(batch) == 1:
+            method, params, priority, future = batch[0]
+            try:
+                result = await self.client.call(method, priority, **params)
+            except Exception as e:
+                _resolve(future, error=e)
+            else:
+                _resolve(future, result)
+            return
+
+        code = execute_code((method, params) for method, params, _, _ in batch)
+        # Пачка идёт с приоритетом самого срочного вызова в ней и ускоряется,
+        # если, пока она ждёт очереди, повысят приоритет любого из вызовов
+        priority = Priority(min(priority_value(item[2]) for item in batch))
+        for item in batch:
+            follow_priority(priority, item[2])
+        try:
+            data = await self.client.request("execute", priority, code=code)
+        except Exception as e:
+            for _, _, _, future in batch:
+                _resolve(future, error=e)
+            return
+
+        # Неудачные вызовы возвращают false, их ошибки идут по порядку
+        message = "нет результата в ответе execute"
+        try:
+            errors = iter(data.get("execute_errors", []))
+            for result, (method, _, _, future) in zip(data["response"], batch):
+                if result is False:
+                    error = next(errors, {})
+                    VK_ERRORS.inc(method, error.get("error_code"))
+                    _resolve(
+                        future,
+                        error=VkRequestError(
+                            method, error.get("error_code"), error.get("error_msg")
+                        ),
+                    )
+                else:
+                    _resolve(future, result)
+        except Exception as e:
+            message = f"некорректный ответ execute: {e!r}"
+        # Вызовы, которым не досталось результата, иначе ждали бы вечно
+        for method, _, _, future in batch:
+            _resolve(future, error=VkRequestError(method, None, message))
+
+
+def _resolve(future, result=None, error=None):
+    """Завершает future, если его ещё не отменили."""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def coalesce_key(method, params):
+    """Ключ вызова: метод и параметры в том виде, в каком они уйдут в VK."""
+    prepared = prepare_params(params)
+    return method, tuple(sorted((key, str(value)) for key, value in prepared.items()))
+
+
+class CoalescingClient:
+    """Объединяет одинаковые одновременные вызовы в один (single-flight).
+
+    Если вызов с тем же методом и параметрами уже выполняется, новый вызов
+    не уходит в VK, а ждёт его результата или ошибки. Годится только для
+    методов, которые ничего не меняют (поиск, фото, города); общий результат
+    нельзя изменять на месте. Потоки, вызывающие клиент через EventLoopThread,
+    попадают в тот же цикл событий и объединяются так же, как корутины.
+    """
+
+    def __init__(self, client):
+        """Оборачивает клиент с методом call (обычно BatchingClient)."""
+        self.client = client
+        self._inflight = {}  # ключ вызова -> (задача, её Priority)
+
+    def __getattr__(self, name):
+        """Остальные методы (queue_size, close и т.д.) берутся у клиента."""
+        return getattr(self.client, name)
+
+    async def call(self, method, priority=INTERACTIVE, **params):
+        """Выполняет вызов или присоединяется к такому же, уже начатому.
+
+        Общий вызов идёт с приоритетом самого срочного из ждущих: если к
+        фоновому вызову, ещё ждущему очереди, присоединяется интерактивный,
+        вызов ускоряется.
+        """
+        key = coalesce_key(method, params)
+        entry = self._inflight.get(key)
+        if entry is None:
+            shared = Priority(priority_value(priority))
+            task = asyncio.ensure_future(self.client.call(method, shared, **params))
+            entry = self._inflight[key] = (task, shared)
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            VK_COALESCED.inc(method)
+        task, shared = entry
+        follow_priority(shared, priority)
+        # Отмена одного из ждущих не должна отменять общий вызов
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        """Убирает завершённый вызов из списка выполняющихся."""
+        if self._inflight.get(key, (None,))[0] is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # ошибку уже получили ждущие; не пишем её в лог
+
+
+class AsyncBotsLongPoll:
+    """Чтение событий сообщества через Bots Long Poll API."""
+
+    def __init__(self, client, group_id=None, wait=25):
+        """Сохраняет клиент с токеном группы; сервер запрашивается лениво."""
+        self.client = client
+        self.group_id = group_id
+        self.wait = wait
+        self.server = None
+        self.key = None
+        self.ts = None
+
+    async def _update_server(self, update_ts=True):
+        """Получает адрес и ключ Long Poll сервера."""
+        if self.group_id is None:
+            response = await self.client.call("groups.getById")
+            groups = response["groups"] if isinstance(response, dict) else response
+            self.group_id = groups[0]["id"]
+        response = await self.client.call(
+            "groups.getLongPollServer", group_id=self.group_id
+        )
+        self.server = response["server"]
+        self.key = response["key"]
+        if update_ts or self.ts is None:
+            self.ts = response["ts"]
+
+    def reconnect(self):
+        """Сбрасывает сервер и ключ; чтение продолжится с последнего ts."""
+        self.server = None
+        self.key = None
+
+    async def check(self):
+        """Ждёт и возвращает очередную пачку событий."""
+        if self.server is None:
+            # После переподключения продолжаем с сохранённого ts, чтобы
+            # не потерять события, пришедшие за время перерыва
+            await self._update_server(update_ts=False)
+        params = {"act": "a_check", "key": self.key, "ts": self.ts, "wait": self.wait}
+        timeout = aiohttp.ClientTimeout(total=self.wait + 10)
+        async with self.client.get_session().get(
+            self.server, params=params, timeout=timeout
+        ) as resp:
+            data = await resp.json(content_type=None)
+
+        failed = data.get("failed")
+        if failed == 1:  # История событий устарела, продолжаем с нового ts
+            self.ts = data["ts"]
+            return []
+        if failed == 2:  # Истёк ключ
+            await self._update_server(update_ts=False)
+            return []
+        if failed == 3:  # Потеряна информация, нужен новый ключ и ts
+            await self._update_server()
+            return []
+        self.ts = data["ts"]
+        return data.get("updates", [])
+
+    async def listen(self):
+        """Бесконечно выдаёт события по одному."""
+        while True:
+            for event in await self.check():
+                yield event
+
+
+class AsyncVkSearcher:
+    """Асинхронный поиск пользователей, городов и фото через VK API."""
+
+    def __init__(self, client, cities=None, store=None, photos=None, searches=None):
+        """Использует клиент с токеном пользователя.
+
+        cities — локальный CityIndex, store — объект с методами save_cities
+        и update_candidate_photos (обычно DatabaseManager), photos и
+        searches — общие TTLCache с топ-фото кандидатов и страницами
+        результатов поиска.
+        """
+        self.client = client
+        self.cities = cities if cities is not None else CityIndex()
+        self.store = store
+        self.photos = photos if photos is not None else TTLCache(10000, 3600)
+        self.searches = searches if searches is not None else TTLCache(1000, 900)
+        self._photo_tasks = {}  # vk_id -> (загрузка фото, её Priority)
+        self._new_photos = {}  # vk_id -> фото, ещё не записанные в БД
+        self._photos_timer = None
+
+    async def get_city_id(self, city_title):
+        """Возвращает ID города по названию (точное или частичное совпадение).
+
+        Сначала ищет в локальном индексе, к VK обращается только при промахе.
+        Название с опечаткой сопоставляется с известным городом, только если
+        VK ничего не нашёл: иначе «Томск» мог бы стать уже известным «Омском».
+        """
+        city_id = self.cities.find(city_title)
+        if city_id:
+            return city_id
+
+        city_title = self.cities.resolve_alias(city_title)
+        try:
+            response = await self.client.call(
+                "database.getCities", country_id=1, q=city_title, count=10
+            )
+            items = response["items"]
+            if not items:
+                return await asyncio.to_thread(self.cities.find_similar, city_title)
+            self.cities.add_cities(items)
+            if self.store:
+                await asyncio.to_thread(self.store.save_cities, items)
+            # Точное совпадение
+            for city in items:
+                if city["title"].lower().strip() == city_title.lower().strip():
+                    return city["id"]
+            # Частичное
+            for city in items:
+                if city_title.lower().strip() in city["title"].lower():
+                    return city["id"]
+            return items[0]["id"]
+        except Exception as e:
+            logging.error(f"Ошибка поиска города: {e}")
+            return None
+
+    async def search_users(self, age_from, age_to, sex, city_id, offset=0):
+        """Ищет пользователей по возрасту, полу и городу.
+        Возвращает список пользователей, к которым доступ открыт."""
+        page = await self.search_page(age_from, age_to, sex, city_id, offset)
+        return page["items"]
+
+    async def search_page(
+        self, age_from, age_to, sex, city_id, offset=0, priority=INTERACTIVE, ttl=None
+    ):
+        """Возвращает страницу поиска: {"items": [...], "next_offset": int | None}.
+
+        Страницы общие для всех пользователей и кэшируются по параметрам поиска
+        (ttl — время жизни записи вместо заданного в кэше).
+        next_offset равен None, если дальше результатов нет. Если запрос
+        не удался, страница не кэшируется и возвращается с "error": True
+        и прежним next_offset, чтобы её можно было запросить ещё раз.
+        """
+        key = (age_from, age_to, sex, city_id, offset)
+        page = self.searches.get(key)
+        if page is not None:
+            return page
+        try:
+            response = await self.client.call(
+                "users.search",
+                priority,
+                age_from=age_from,
+                age_to=age_to,
+                sex=sex,
+                city_id=city_id,
+                has_photo=1,
+                count=SEARCH_PAGE_SIZE,
+                offset=offset,
+                fields="bdate,city,sex,is_closed,can_access_closed",
+            )
+        except Exception as e:
+            logging.error(f"Ошибка поиска пользователей: {e}")
+            return {"items": [], "next_offset": offset, "error": True}
+
+        # Фильтрация: пропускаем пользователей, к которым нет доступа
+        users = []
+        for person in response["items"]:
+            if person.get("is_closed", False) and not person.get(
+                "can_access_closed", False
+            ):
+                continue  # пропустить приватного пользователя
+            users.append(person)
+
+        next_offset = offset + SEARCH_PAGE_SIZE
+        total = min(response.get("count", 0), SEARCH_MAX_RESULTS)
+        if len(response["items"]) < SEARCH_PAGE_SIZE or next_offset >= total:
+            next_offset = None
+        page = {"items": users, "next_offset": next_offset}
+        self.searches.set(key, page, ttl)
+        return page
+
+    async def get_top_photos(self, user_id, priority=INTERACTIVE):
+        """Возвращает топ-3 фото профиля по лайкам и комментариям.
+
+        Результат берётся из кэша; одновременные запросы фото одного и того же
+        кандидата (например, показ и предзагрузка) ждут одну общую загрузку.
+        Если к фоновой загрузке присоединяется интерактивный запрос, загрузка
+        получает его приоритет.
+        """
+        photos = self.photos.get(user_id)
+        if photos is not None:
+            return photos
+        entry = self._photo_tasks.get(user_id)
+        if entry is None:
+            shared = Priority(priority_value(priority))
+            task = asyncio.ensure_future(self._fetch_top_photos(user_id, shared))
+            entry = self._photo_tasks[user_id] = (task, shared)
+            task.add_done_callback(lambda _: self._photo_tasks.pop(user_id, None))
+        task, shared = entry
+        follow_priority(shared, priority)
+        return await asyncio.shield(task)
+
+    async def _fetch_top_photos(self, user_id, priority):
+        """Загружает фото профиля из VK и кладёт топ-3 в кэш."""
+        try:
+            photos = await self.client.call(
+                "photos.get",
+                priority,
+                owner_id=user_id,
+                album_id="profile",
+                extended=1,
+                count=30,
+            )
+            top = sorted(
+                photos["items"],
+                key=lambda p: p["likes"]["count"] + p["comments"]["count"],
+                reverse=True,
+            )
+            result = [f"photo{user_id}_{p['id']}" for p in top[:3]]
+            self.photos.set(user_id, result)
+            self._remember_photos(user_id, result)
+            return result
+        except Exception as e:
+            logging.error(f"Ошибка получения фото: {e}")
+            return []
+
+    def _remember_photos(self, user_id, photos):
+        """Откладывает запись фото в БД, чтобы сохранить их одной пачкой."""
+        if not self.store:
+            return
+        self._new_photos[user_id] = photos
+        if self._photos_timer is None:
+            self._photos_timer = asyncio.get_running_loop().call_later(
+                PHOTO_FLUSH_DELAY, lambda: asyncio.ensure_future(self.flush_photos())
+            )
+
+    async def flush_photos(self):
+        """Записывает накопленные фото кандидатов в БД."""
+        if self._photos_timer is not None:
+            self._photos_timer.cancel()
+            self._photos_timer = None
+        batch, self._new_photos = self._new_photos, {}
+        if not batch:
+            return
+        try:
+            await asyncio.to_thread(self.store.update_candidate_photos, batch)
+        except Exception as e:
+            logging.error(f"Ошибка сохранения фото: {e}")
+
+    async def prefetch_photos(self, user_ids):
+        """Заранее загружает в кэш фото следующих кандидатов."""
+        await asyncio.gather(
+            *(
+                self.get_top_photos(uid, BACKGROUND)
+                for uid in user_ids
+                if uid not in self.photos
+            )
+        )
+
+
+class EventLoopThread:
+    """Цикл событий asyncio в фоновом потоке для вызова корутин из обычного кода."""
+
+    def __init__(self):
+        """Запускает цикл событий в отдельном потоке."""
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="vk-event-loop", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, coro):
+        """Планирует корутину и возвращает concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Выполняет корутину и блокирует поток до получения результата."""
+        return self.submit(coro).result(timeout)
+
+    def iterate(self, agen):
+        """Превращает асинхронный генератор в обычный."""
+        while True:
+            try:
+                yield self.run(agen.__anext__())
+            except StopAsyncIteration:
+                return
+
+    def stop(self):
+        """Останавливает цикл событий."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class VkApiProxy:
+    """Синхронный вызов методов в стиле vk_api: vk.messages.send(...)."""
+
+    def __init__(self, client, loop, method=None):
+        """Связывает клиент с фоновым циклом событий."""
+        self._client = client
+        self._loop = loop
+        self._method = method
+
+    def __getattr__(self, name):
+        """Дополняет имя метода: vk.messages -> vk.messages.send."""
+        method = f"{self._method}.{name}" if self._method else name
+        return VkApiProxy(self._client, self._loop, method)
+
+    def __call__(self, **params):
+        """Выполняет вызов и возвращает результат."""
+        return self._loop.run(self._client.call(self._method, **params))
@@ -0,0 +1,140 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+from vk_async import INTERACTIVE, Priority, VkRequestError
+
+TOO_MANY_REQUESTS = 6
+
+
+class TokenBucket:
+    """Ведро токенов: в среднем rate запросов в секунду, не больше burst подряд."""
+
+    def __init__(self, rate, burst=None):
+        """Задаёт скорость пополнения и ёмкость ведра."""
+        self.rate = rate
+        # Ёмкость меньше одного токена не позволила бы сделать ни одного запроса
+        self.capacity = max(1, burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        """Пополняет ведро за прошедшее время."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Забирает токен, если он есть; иначе возвращает время ожидания в секундах."""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class VkScheduler:
+    """Единая точка вызовов VK API с ограничением частоты по каждому токену.
+
+    Запросы распределяются по клиентам взвешенным round-robin, каждый токен
+    ограничен своим TokenBucket. Ожидающие вызовы обслуживаются по приоритету
+    (INTERACTIVE раньше BACKGROUND; приоритет Priority можно повысить, пока
+    вызов ждёт), а ошибка 6 «слишком много запросов»
+    повторяется с экспоненциальной задержкой и случайным разбросом.
+    """
+
+    def __init__(self, clients, rate=3, weights=None, retries=3, retry_delay=0.5):
+        """Принимает список AsyncVkClient и веса токенов (по умолчанию равные)."""
+        self.clients = list(clients)
+        weights = weights or [1] * len(self.clients)
+        self.buckets = [TokenBucket(rate * w) for w in weights]
+        # Порядок обхода: токен с весом 2 встречается в круге дважды
+        self.schedule = [
+            i
+            for turn in range(max(weights))
+            for i, weight in enumerate(weights)
+            if weight > turn
+        ]
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._position = 0
+        self._waiters = []  # куча [priority, номер, future]
+        self._counter = itertools.count()
+        self._pump_task = None
+
+    def __getattr__(self, name):
+        """Остальные методы (get_session и т.д.) берутся у первого клиента."""
+        return getattr(self.clients[0], name)
+
+    def _next_client(self):
+        """Возвращает (клиент, 0) со свободным токеном или (None, время ожидания)."""
+        wait = None
+        for _ in range(len(self.schedule)):
+            index = self.schedule[self._position]
+            self._position = (self._position + 1) % len(self.schedule)
+            delay = self.buckets[index].try_acquire()
+            if not delay:
+                return self.clients[index], 0
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _pump(self):
+        """Раздаёт свободные токены ожидающим вызовам в порядке приоритета."""
+        try:
+            while self._waiters:
+                if self._waiters[0][2].done():  # вызов отменили
+                    heapq.heappop(self._waiters)
+                    continue
+                client, wait = self._next_client()
+                if client is None:
+                    await asyncio.sleep(wait)
+                    continue
+                _, _, future = heapq.heappop(self._waiters)
+                future.set_result(client)
+        finally:
+            self._pump_task = None
+
+    async def _acquire(self, priority):
+        """Ждёт своей очереди и возвращает клиента для вызова."""
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._counter), future]
+        if isinstance(priority, Priority):
+            entry[0] = priority.value
+
+            def escalate():
+                # Вызов ещё ждёт: переставляем его в куче по новому приоритету
+                if not future.done():
+                    entry[0] = priority.value
+                    heapq.heapify(self._waiters)
+
+            priority.subscribe(escalate)
+        heapq.heappush(self._waiters, entry)
+        if self._pump_task is None:
+            self._pump_task = asyncio.ensure_future(self._pump())
+        return await future
+
+    def queue_size(self):
+        """Возвращает число вызовов, ожидающих свободного токена."""
+        return len(self._waiters)
+
+    async def request(self, method, priority=INTERACTIVE, **params):
+        """Вызывает метод VK API и возвращает ответ целиком."""
+        for attempt in range(self.retries + 1):
+            client = await self._acquire(priority)
+            try:
+                return await client.request(method, **params)
+            except VkRequestError as e:
+                if e.code != TOO_MANY_REQUESTS or attempt == self.retries:
+                    raise
+            delay = self.retry_delay * 2**attempt
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+
+    async def call(self, method, priority=INTERACTIVE, **params):
+        """Вызывает метод VK API и возвращает поле response."""
+        return (await self.request(method, priority, **params))["response"]
+
+    async def close(self):
+        """Закрывает HTTP-сессии всех клиентов."""
+        for client in self.clients:
+            await client.close()
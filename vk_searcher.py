@@ -1,74 +1,90 @@
-from vk_api import VkApi
+from city_index import CityIndex
+from vk_async import (API_URL, AsyncVkClient, AsyncVkSearcher, BatchingClient,
+                      CoalescingClient, EventLoopThread)
+from vk_scheduler import VkScheduler
 
 
 class VkSearcher:
-    """Класс для поиска пользователей, городов и фото через VK API."""
+    """Класс для поиска пользователей, городов и фото через VK API.
 
-    def __init__(self, token):
-        """Инициализирует API с токеном пользователя."""
-        self.session = VkApi(token=token)
-        self.api = self.session.get_api()
+    Синхронная обёртка над AsyncVkSearcher: вызовы выполняются в общем
+    фоновом цикле событий.
+    """
+
+    def __init__(
+        self,
+        tokens,
+        loop=None,
+        db=None,
+        photo_cache=None,
+        search_cache=None,
+        batch_window=0.01,
+        rate_limit=3,
+        api_url=API_URL,
+    ):
+        """Инициализирует API с токеном пользователя.
+
+        tokens — токен или список токенов (строк либо пар (токен, вес)),
+        между которыми распределяются запросы; rate_limit — запросов в секунду
+        на токен. Если передана БД, справочник городов загружается из неё
+        и пополняется, а найденные фото кандидатов сохраняются в неё.
+        Вызовы, пришедшие в течение batch_window секунд, объединяются в execute,
+        а одинаковые одновременные вызовы (один и тот же город, фото одного
+        кандидата) выполняются один раз — и из потоков, и из корутин.
+        api_url позволяет направить запросы на другой сервер (например, тестовый).
+        """
+        self.loop = loop or EventLoopThread()
+        if isinstance(tokens, str):
+            tokens = [tokens]
+        tokens = [t if isinstance(t, tuple) else (t, 1) for t in tokens]
+        scheduler = VkScheduler(
+            [AsyncVkClient(token, api_url) for token, _ in tokens],
+            rate=rate_limit,
+            weights=[weight for _, weight in tokens],
+        )
+        cities = CityIndex(db.get_cities() if db else ())
+        client = CoalescingClient(BatchingClient(scheduler, window=batch_window))
+        self.searcher = AsyncVkSearcher(
+            client,
+            cities=cities,
+            store=db,
+            photos=photo_cache,
+            searches=search_cache,
+        )
+        self._prewarm = None
 
     def get_city_id(self, city_title):
         """Возвращает ID города по названию (точное или частичное совпадение)."""
-        try:
-            response = self.api.database.getCities(country_id=1, q=city_title, count=10)
-            items = response["items"]
-            if not items:
-                return None
-            # Точное совпадение
-            for city in items:
-                if city["title"].lower().strip() == city_title.lower().strip():
-                    return city["id"]
-            # Частичное
-            for city in items:
-                if city_title.lower().strip() in city["title"].lower():
-                    return city["id"]
-            return items[0]["id"]
-        except Exception as e:
-            print(f"Ошибка поиска города: {e}")
-            return None
+        return self.loop.run(self.searcher.get_city_id(city_title))
 
     def search_users(self, age_from, age_to, sex, city_id, offset=0):
         """Ищет пользователей по возрасту, полу и городу.
         Возвращает список пользователей, к которым доступ открыт."""
-        try:
-            response = self.api.users.search(
-                age_from=age_from,
-                age_to=age_to,
-                sex=sex,
-                city_id=city_id,
-                has_photo=1,
-                count=100,
-                offset=offset,
-                fields="bdate,city,sex,is_closed,can_access_closed",
-                v="5.199",
-            )
-            # Фильтрация: пропускаем пользователей, к которым нет доступа
-            users = []
-            for person in response["items"]:
-                if person.get("is_closed", False) and not person.get(
-                    "can_access_closed", False
-                ):
-                    continue  # пропустить приватного пользователя
-                users.append(person)
-            return users
-        except Exception as e:
-            print(f"Ошибка поиска пользователей: {e}")
-            return []
+        return self.loop.run(
+            self.searcher.search_users(age_from, age_to, sex, city_id, offset)
+        )
+
+    def search_page(self, age_from, age_to, sex, city_id, offset=0):
+        """Возвращает страницу поиска: {"items": [...], "next_offset": int | None}."""
+        return self.loop.run(
+            self.searcher.search_page(age_from, age_to, sex, city_id, offset)
+        )
 
     def get_top_photos(self, user_id):
         """Возвращает топ-3 фото профиля по лайкам и комментариям."""
-        try:
-            photos = self.api.photos.get(
-                owner_id=user_id, album_id="profile", extended=1, count=30
-            )
-            top = sorted(
-                photos["items"],
-                key=lambda p: p["likes"]["count"] + p["comments"]["count"],
-                reverse=True,
-            )
-            return [f"photo{user_id}_{p['id']}" for p in top[:3]]
-        except Exception as e:
-            print(f"Ошибка получения фото: {e}")
-            return []
+        return self.loop.run(self.searcher.get_top_photos(user_id))
+
+    def prefetch_photos(self, user_ids):
+        """Запускает фоновую загрузку фото кандидатов, не дожидаясь результата."""
+        return self.loop.submit(self.searcher.prefetch_photos(list(user_ids)))
+
+    def start_prewarm(self, prewarmer):
+        """Запускает фоновый прогрев кэша (Prewarmer) в цикле событий поисковика."""
+        self._prewarm = self.loop.submit(prewarmer.run())
+
+    def close(self):
+        """Сохраняет накопленные фото и закрывает HTTP-соединения поисковика."""
+        if self._prewarm is not None:
+            self._prewarm.cancel()
+        self.loop.run(self.searcher.flush_photos())
+        self.loop.run(self.searcher.client.close())